@@ -5,9 +5,2492 @@ import time
 import json
 import os
 import math
+import functools
+import sys
+import argparse
+import sqlite3
+import getpass
+import heapq
+import tempfile
+import shutil
+import subprocess
+import threading
+import itertools
+import atexit
+import queue
+import collections
+import array
+import struct
+import stat
+import base64
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+np = None  # NumPy, imported by load_numpy() on first use to keep startup fast
+asyncio = None  # Only races need it, imported by load_asyncio()
+UMASK = os.umask(0)  # Read once here, setting it back is racy once worker threads run
+os.umask(UMASK)
+
+
+def load_numpy():
+    """Import NumPy on first use; returns None when it isn't installed"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:  # Only needed for the difficulty simulator
+            return None
+        np = numpy
+    return np
+
+
+def load_asyncio():
+    """Import asyncio on first use, for the race server and client"""
+    global asyncio
+    if asyncio is None:
+        import asyncio as module
+        asyncio = module
+    return asyncio
+
+# Seconds per brick for each speed mode and max number for each hardness
+SPEED_MODES = {"Newbie": 20, "Beginner": 12, "Intermediate": 8, "Expert": 4}
+HARDNESS_LEVELS = {"Easy": 100, "Medium": 250, "Hard": 500, "Insane": 1000}
+
+# Speed increase mode: bricks get 10% faster every 10 levels
+SPEED_RAMP_LEVELS = 10
+SPEED_RAMP_FACTOR = 0.9
+
+# Playfield geometry shared by the engine and the Tk front-end
+CANVAS_WIDTH = 450
+CANVAS_HEIGHT = 480
+BRICK_X = 175  # Center of 450px wide canvas minus half brick width (100/2)
+BRICK_WIDTH = 100
+BRICK_HEIGHT = 40
+GROUND_Y = 360  # Ground level minus brick height
+LANE_XS = [10, 120, 230, 340]  # Brick columns in multi-brick mode
+LANE_CLEARANCE = BRICK_HEIGHT + 10  # Drop needed before a lane takes another brick
+RESPAWN_DELAY = 0.5  # Seconds between a correct answer and the next brick
+SKY_COLORS = ["#87CEEB", "#7EC0EE", "#6BB6FF", "#5CACEE", "#4F94CD", "#4682B4"]  # 65px bands
+BACKGROUND_VARIANTS = 8  # Distinct lit-window patterns, each baked once
+BACKGROUND_CACHE_DIR = "background_cache"
+BACKGROUND_RENDER_VERSION = 1  # Bump when the backdrop drawing changes, to skip stale cached PNGs
+SESSION_LOG_DIR = "session_logs"
+PERFORMANCE_DB = "player_stats.db"
+PROFILE_DIR = "profiles"
+ANSWER_HISTORY_DIR = "answer_history"
+SNAPSHOT_FILE = "saved_game.bin"
+AUTOSAVE_INTERVAL = 5.0  # Seconds of play between saves of the running game
+DRILL_FILE = "drill_schedule.json"
+DRILL_MODE = "Drill"  # current_mode of "Today's drill" games
+DRILL_RELEARN = 600.0  # Seconds until a missed number is due again
+DRILL_START_EASE = 2.5
+DRILL_MIN_EASE = 1.3
+LEADERBOARD_FILE = "leaderboard.json"
+LEADERBOARD_SIZE = 100  # Scores kept per mode/hardness key
+MAX_CUSTOM_NUMBER = 1_000_000  # Largest custom range
+RACE_MODE = "Race"  # current_mode of games started by a race server
+RACE_PORT = 8765
+RACE_LINE_LIMIT = 1024  # Longest message a race client may send, in bytes
+RACE_NAME_LIMIT = 24
+RACE_OUTBOX_LIMIT = 32  # Unsent control messages before a stalled client is dropped
+RACE_TOP = 10  # Players listed in race standings
+RACE_GRACE = 2.0  # Seconds of network slack before the server calls a miss itself
+
+
+class ProblemGenerator:
+    """Turns the engine's brick numbers 1..max_number into problems
+
+    Subclasses give the brick text in prompt() and the answer in
+    formula(), written so it works on an int and elementwise on a NumPy
+    array alike. The answers for the whole range are computed once into a
+    flat int32/int64 buffer (NumPy when available, array otherwise), so
+    checking an answer is an index, not arithmetic or a dict lookup; a
+    million-number range takes 4-8 MB. Use problem_generator() to share
+    the tables between games.
+    """
+
+    name = None
+    label = None
+
+    def __init__(self, max_number):
+        self.max_number = max_number
+        self.table = self.build_table()
+
+    def build_table(self):
+        if load_numpy() is not None:
+            table = self.formula(np.arange(self.max_number + 1, dtype=np.int64))
+            return table.astype(np.int32) if table.max() < 2 ** 31 else table
+        table = array.array("q", map(self.formula, range(self.max_number + 1)))
+        return array.array("i", table) if max(table) < 2 ** 31 else table
+
+    def answer(self, number):
+        return int(self.table[number])
+
+    def prompt(self, number):
+        return str(number)
+
+    def formula(self, n):
+        raise NotImplementedError
+
+
+class SquareProblems(ProblemGenerator):
+    name = "squares"
+    label = "Squares (n²)"
+
+    def formula(self, n):
+        return n * n
+
+
+class CubeProblems(ProblemGenerator):
+    name = "cubes"
+    label = "Cubes (n³)"
+
+    def prompt(self, number):
+        return f"{number}³"
+
+    def formula(self, n):
+        return n * n * n
+
+
+class ProductProblems(ProblemGenerator):
+    """Times tables grown one square shell at a time
+
+    Numbers (s-1)² + 1 to s² are s × 1 .. s × s followed by 1 × s ..
+    (s-1) × s, so the first k² numbers are the k × k table: the Easy range
+    of 100 is the 10 × 10 table. The mapping doesn't depend on max_number,
+    so a number names the same product in every range, and the answer
+    history, heatmap and drill schedule stay comparable across hardness.
+    """
+
+    name = "products"
+    label = "Products (a × b)"
+
+    def factors(self, n):
+        if isinstance(n, int):
+            shell = math.isqrt(max(n - 1, 0)) + 1
+            offset = n - (shell - 1) ** 2 - 1
+            return (shell, offset + 1) if offset < shell else (offset - shell + 1, shell)
+        # Float sqrt is exact on these perfect squares, far below 2**52
+        shell = np.sqrt(np.maximum(n - 1, 0)).astype(np.int64) + 1
+        offset = n - (shell - 1) ** 2 - 1
+        first_half = offset < shell
+        return (np.where(first_half, shell, offset - shell + 1),
+                np.where(first_half, offset + 1, shell))
+
+    def prompt(self, number):
+        a, b = self.factors(number)
+        return f"{a}×{b}"
+
+    def formula(self, n):
+        a, b = self.factors(n)
+        return a * b
+
+
+class SquareRootProblems(ProblemGenerator):
+    name = "roots"
+    label = "Square roots (√n²)"
+
+    def prompt(self, number):
+        return f"√{number * number}"
+
+    def formula(self, n):
+        return n
+
+
+PROBLEM_TYPES = {cls.name: cls for cls in
+                 (SquareProblems, CubeProblems, ProductProblems, SquareRootProblems)}
+
+
+@functools.lru_cache(maxsize=8)
+def problem_generator(name, max_number):
+    """Shared generator, and its answer table, for a problem type and range"""
+    return PROBLEM_TYPES[name](max_number)
+
+
+class GameEngine:
+    """Headless game rules and state, advanced by simulated time.
+
+    The engine knows nothing about Tkinter: clients call step() with the
+    elapsed time, submit_answer() with typed answers, and react to the
+    events that step() returns:
+
+        ("spawn", number)   a new brick appeared
+        ("miss", number)    a brick hit the ground and a life was lost
+        ("game_over",)      the last life was lost
+
+    Numbers come from a generator seeded per session, and everything that
+    changes the game is written to the optional SessionLog in self.log, so
+    a session can be replayed exactly with replay_session().
+
+    With adaptive=True numbers come from an AdaptiveNumberPicker that
+    favours the ones missed or answered slowly this session. problems
+    names the ProblemGenerator that turns numbers into the questions
+    asked and their answers. Another picker, such as a DrillPicker, can be
+    assigned to self.picker; the game ends when its pick() returns None.
+    """
+
+    def __init__(self, speed, max_number, lives, speed_increase=False, seed=None,
+                 adaptive=False, problems="squares"):
+        self.brick_speed = speed
+        self.base_speed = speed  # Store original speed for speed increase mode
+        self.speed_increase_mode = speed_increase
+        self.max_number = max_number
+        self.lives = lives
+        self.starting_lives = lives  # What the leaderboard checks, lives only counts down
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.rng = random.Random(self.seed)
+        self.picker = AdaptiveNumberPicker(max_number) if adaptive else None
+        self.problems = problem_generator(problems, max_number)
+        self.log = None
+        self.level = 0
+        self.correct_answers = 0
+        self.total_time = 0
+        self.answer_times = []
+        self.failed_numbers = []
+        self.current_number = None
+        self.brick_y = 0
+        self.brick_start = 0
+        self.brick_elapsed = 0
+        self.respawn_at = None
+        self.clock = 0
+        self.game_active = True
+        self.game_paused = False
+
+    def describe(self):
+        """The constructor arguments, as stored in session log headers"""
+        return {"speed": self.base_speed, "max_number": self.max_number,
+                "lives": self.lives, "speed_increase": self.speed_increase_mode,
+                "seed": self.seed, "adaptive": self.picker is not None,
+                "problems": self.problems.name}
+
+    def record(self, code, *data):
+        if self.log is not None:
+            self.log.record(self.clock, code, *data)
+
+    def spawn_brick(self):
+        if self.picker is not None:
+            self.current_number = self.picker.pick(self.rng)
+            if self.current_number is None:
+                # A picker with a fixed set of numbers, like a drill, ran out
+                self.game_active = False
+                return None
+        else:
+            self.current_number = self.rng.randint(1, self.max_number)
+        self.brick_y = 0
+        self.brick_start = self.clock
+        self.brick_elapsed = 0
+        self.respawn_at = None
+        self.record(SessionLog.SPAWN, self.current_number)
+        return self.current_number
+
+    def prioritize(self, numbers):
+        """Raise the adaptive picker's weight of numbers; ignored by other pickers"""
+        if isinstance(self.picker, AdaptiveNumberPicker):
+            self.picker.prioritize(numbers)
+            self.record(SessionLog.PRIORITIZE, list(numbers))
+
+    def toggle_pause(self):
+        if self.game_active:
+            self.game_paused = not self.game_paused
+            self.record(SessionLog.PAUSE if self.game_paused else SessionLog.RESUME)
+        return self.game_paused
+
+    def step(self, dt):
+        """Advance the game by dt seconds and return the resulting events"""
+        return self.advance_to(self.clock + dt)
+
+    def advance_to(self, clock):
+        """Advance the game to an absolute simulated time
+
+        All timing is derived from the clock value itself, so stepping to
+        the same times reproduces the same events bit for bit.
+        """
+        events = []
+        if not self.game_active or self.game_paused:
+            return events
+
+        self.clock = clock
+
+        # Waiting for the next brick after a correct answer
+        if self.current_number is None:
+            if self.respawn_at is not None and self.clock >= self.respawn_at:
+                number = self.spawn_brick()
+                events.append(("spawn", number) if number is not None else ("game_over",))
+            return events
+
+        # Move brick down; position follows elapsed time so the fall takes
+        # exactly brick_speed seconds however the steps are sliced
+        self.brick_elapsed = self.clock - self.brick_start
+        self.brick_y = GROUND_Y * min(self.brick_elapsed / self.brick_speed, 1)
+
+        # Check if brick hit the ground
+        if self.brick_elapsed >= self.brick_speed:
+            events.extend(self.lose_life())
+        return events
+
+    def submit_answer(self, answer, answer_time=None):
+        """Check an answer against the current brick, returns True if correct
+
+        answer_time overrides the simulated time spent on the brick for
+        clients that measure it with their own clock.
+        """
+        if not self.game_active or self.game_paused or self.current_number is None:
+            return False
+        self.record(SessionLog.ANSWER, answer, answer_time)
+        if answer != self.problems.answer(self.current_number):
+            return False
+
+        if answer_time is None:
+            answer_time = self.brick_elapsed
+        self.count_correct(self.current_number, answer_time)
+        self.current_number = None
+        self.respawn_at = self.clock + RESPAWN_DELAY
+        return True
+
+    def count_correct(self, number, answer_time, brick_speed=None):
+        """Score a correctly answered brick, shared by every engine
+
+        brick_speed is the fall time the picker grades answer_time
+        against, the current speed (after any ramp-up) by default.
+        """
+        self.correct_answers += 1
+        self.level += 1
+
+        # Apply speed increase if enabled (every 10 levels)
+        if self.speed_increase_mode and self.level % SPEED_RAMP_LEVELS == 0:
+            self.brick_speed = self.base_speed * (SPEED_RAMP_FACTOR ** (self.level // SPEED_RAMP_LEVELS))
+
+        # Record time
+        self.answer_times.append(answer_time)
+        self.total_time += answer_time
+        if self.picker is not None:
+            self.picker.record_answer(number, answer_time,
+                                      self.brick_speed if brick_speed is None else brick_speed)
+
+    def count_miss(self, number):
+        """Take a life for a brick that hit the ground, True if it was the last"""
+        self.lives -= 1
+        self.failed_numbers.append(number)
+        if self.picker is not None:
+            self.picker.record_miss(number)
+        self.record(SessionLog.MISS, number)
+        if self.lives <= 0:
+            self.game_active = False
+            self.game_paused = False
+            return True
+        return False
+
+    def lose_life(self):
+        missed = self.current_number
+        self.current_number = None
+        events = [("miss", missed)]
+        if self.count_miss(missed):
+            events.append(("game_over",))
+        else:
+            number = self.spawn_brick()
+            events.append(("spawn", number) if number is not None else ("game_over",))
+        return events
+
+
+class Brick:
+    """One falling brick in MultiBrickEngine"""
+
+    __slots__ = ("id", "number", "lane", "start", "speed", "y")
+
+    def __init__(self, brick_id, number, lane, start, speed):
+        self.id = brick_id
+        self.number = number
+        self.lane = lane
+        self.start = start
+        self.speed = speed
+        self.y = 0
+
+
+class MultiBrickEngine(GameEngine):
+    """GameEngine variant with up to max_bricks bricks falling at once
+
+    Bricks fall in len(LANE_XS) lanes and a new one is released every
+    brick_speed / max_bricks seconds into a lane whose top is clear. Typed
+    answers are looked up in a dict from answer to the live bricks asking
+    for it, so matching is O(1) however many bricks are on screen; the lowest
+    such brick is the one resolved. Events carry the brick id as a third
+    element: ("spawn", number, brick_id) and ("miss", number, brick_id).
+    Scoring and lives go through GameEngine.count_correct() and
+    count_miss(); only the lanes are handled here.
+    """
+
+    def __init__(self, speed, max_number, lives, speed_increase=False, seed=None,
+                 adaptive=False, max_bricks=8, problems="squares"):
+        super().__init__(speed, max_number, lives, speed_increase, seed, adaptive, problems)
+        self.max_bricks = max_bricks
+        self.bricks = {}  # Live bricks by id, in spawn order
+        self.by_answer = {}  # Answer -> ids of live bricks asking for it
+        self.lane_last = [None] * len(LANE_XS)  # Newest brick in each lane
+        self.next_brick_id = 0
+        self.next_spawn_at = 0
+
+    def describe(self):
+        header = super().describe()
+        header["max_bricks"] = self.max_bricks
+        return header
+
+    def spawn_brick(self):
+        # Lanes whose newest brick has fallen clear of the top
+        free_lanes = [lane for lane, brick in enumerate(self.lane_last)
+                      if brick is None or brick.id not in self.bricks or brick.y >= LANE_CLEARANCE]
+        if not free_lanes:
+            return None
+        lane = free_lanes[self.rng.randrange(len(free_lanes))]
+        
+        if self.picker is not None:
+            number = self.picker.pick(self.rng)
+        else:
+            number = self.rng.randint(1, self.max_number)
+        brick = Brick(self.next_brick_id, number, lane, self.clock, self.brick_speed)
+        self.next_brick_id += 1
+        self.bricks[brick.id] = brick
+        self.by_answer.setdefault(self.problems.answer(number), []).append(brick.id)
+        self.lane_last[lane] = brick
+        self.next_spawn_at = self.clock + self.brick_speed / self.max_bricks
+        self.record(SessionLog.SPAWN, number)
+        return brick
+
+    def remove_brick(self, brick):
+        del self.bricks[brick.id]
+        answer = self.problems.answer(brick.number)
+        ids = self.by_answer[answer]
+        ids.remove(brick.id)
+        if not ids:
+            del self.by_answer[answer]
+
+    def advance_to(self, clock):
+        events = []
+        if not self.game_active or self.game_paused:
+            return events
+
+        self.clock = clock
+        
+        landed = []
+        for brick in self.bricks.values():
+            elapsed = self.clock - brick.start
+            brick.y = GROUND_Y * min(elapsed / brick.speed, 1)
+            if elapsed >= brick.speed:
+                landed.append(brick)
+        for brick in landed:
+            events.extend(self.lose_life(brick))
+            if not self.game_active:
+                return events
+        
+        if len(self.bricks) < self.max_bricks and self.clock >= self.next_spawn_at:
+            brick = self.spawn_brick()
+            if brick is not None:
+                events.append(("spawn", brick.number, brick.id))
+        return events
+
+    def submit_answer(self, answer, answer_time=None):
+        """Resolve the lowest live brick whose square is answer
+
+        Returns that Brick, or None if no live brick matches.
+        """
+        if not self.game_active or self.game_paused or not self.bricks:
+            return None
+        self.record(SessionLog.ANSWER, answer, answer_time)
+        ids = self.by_answer.get(answer)
+        if not ids:
+            return None
+        brick = self.bricks[ids[0]]  # Spawned first, so lowest in the same speed
+        self.remove_brick(brick)
+        if answer_time is None:
+            answer_time = self.clock - brick.start
+        self.count_correct(brick.number, answer_time, brick.speed)
+        return brick
+
+    def lose_life(self, brick):
+        self.remove_brick(brick)
+        events = [("miss", brick.number, brick.id)]
+        if self.count_miss(brick.number):
+            events.append(("game_over",))
+        return events
+
+
+class FenwickSampler:
+    """Weighted sampling over the numbers 1..size with a Fenwick tree
+
+    Both set_weight() and sample() are O(log size), so weights can be
+    adjusted after every brick even on the largest custom range.
+    """
+
+    def __init__(self, size, weight=1.0):
+        self.size = size
+        self.weights = [weight] * (size + 1)  # 1-based, index 0 unused
+        # With equal weights node i covers lowbit(i) numbers. Nodes 1 to
+        # 2**k - 1 repeat in 2**k + 1 onwards, so the tree is built by
+        # doubling it with list copies instead of a loop over every node
+        tree = [0.0, weight]
+        while len(tree) <= size:
+            top = tree[-1] * 2
+            tree.extend(tree[1:min(len(tree) - 1, size - len(tree) + 2)])
+            tree.append(top)
+        del tree[size + 1:]
+        self.tree = tree
+        self.top_bit = 1 << (size.bit_length() - 1) if size else 0
+
+    @property
+    def total(self):
+        total = 0.0
+        i = self.size
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def set_weight(self, number, weight):
+        delta = weight - self.weights[number]
+        self.weights[number] = weight
+        i = number
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def sample(self, rng):
+        """Draw a number with probability proportional to its weight"""
+        target = rng.random() * self.total
+        pos = 0
+        step = self.top_bit
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return min(pos + 1, self.size)
+
+
+class AdaptiveNumberPicker:
+    """Chooses brick numbers with extra weight on the player's weak squares
+
+    Every number starts at weight 1. A miss doubles its weight and a slow
+    answer (over slow_fraction of the brick time) raises it by half, up to
+    max_weight; quick correct answers halve it back towards 1. The weights
+    that aren't 1 are kept in self.raised, so saving them doesn't scan the
+    whole range, and the FenwickSampler over the range is only built by
+    the first pick(), so restoring a saved game doesn't wait for it.
+    """
+
+    def __init__(self, max_number, max_weight=16.0, slow_fraction=0.5):
+        self.max_number = max_number
+        self.sampler = None  # Built on the first pick()
+        self.max_weight = max_weight
+        self.slow_fraction = slow_fraction
+        self.raised = {}  # number -> weight, for weights other than 1
+
+    def pick(self, rng):
+        if self.sampler is None:
+            self.sampler = FenwickSampler(self.max_number)
+            for number, weight in self.raised.items():
+                self.sampler.set_weight(number, weight)
+        return self.sampler.sample(rng)
+
+    def weight(self, number):
+        return self.raised.get(number, 1.0)
+
+    def set_weight(self, number, weight):
+        if self.sampler is not None:
+            self.sampler.set_weight(number, weight)
+        if weight != 1.0:
+            self.raised[number] = weight
+        else:
+            self.raised.pop(number, None)
+
+    def adjust(self, number, factor):
+        weight = self.weight(number) * factor
+        self.set_weight(number, min(self.max_weight, max(1.0, weight)))
+
+    def record_miss(self, number):
+        self.adjust(number, 2.0)
+
+    def prioritize(self, numbers, weight=4.0):
+        """Start numbers, such as the player's lifetime weakest, at a raised weight"""
+        for number in numbers:
+            if 1 <= number <= self.max_number:
+                self.set_weight(number, min(self.max_weight, max(weight, self.weight(number))))
+
+    def record_answer(self, number, answer_time, brick_speed):
+        if answer_time > brick_speed * self.slow_fraction:
+            self.adjust(number, 1.5)
+        else:
+            self.adjust(number, 0.5)
+
+
+class DrillSchedule:
+    """When each number is next due for review, per problem type, SM-2 style
+
+    Each scheduled number holds [interval, ease, due, reviews, lapses] with
+    interval in seconds and due as a Unix time. A miss puts the number on
+    a short relearning interval and lowers its ease. Answering a due number
+    moves it out to one day, then six, then the interval times the ease.
+    Fast answers raise the ease and slow ones lower it, so mastered numbers
+    fade out over weeks while weak ones keep coming back.
+
+    Each problem type keeps a heap of (due, number) entries, so the most
+    overdue number is found in O(log n). Rescheduling pushes a new entry;
+    entries whose due no longer matches their item are dropped when they
+    reach the top. changed is set by every reschedule, so the owner only
+    writes the schedule back when a drill result moved something.
+    """
+
+    INTERVAL, EASE, DUE, REVIEWS, LAPSES = range(5)
+    DAY = 86400.0
+
+    def __init__(self, items=None):
+        self.items = items or {}  # problems -> {number: [interval, ease, due, reviews, lapses]}
+        self.heaps = {}
+        for problems, numbers in self.items.items():
+            heap = [(item[self.DUE], number) for number, item in numbers.items()]
+            heapq.heapify(heap)
+            self.heaps[problems] = heap
+        self.changed = False
+
+    @classmethod
+    def load(cls, path=DRILL_FILE):
+        """The schedule saved at path, or an empty one if there is none yet
+
+        Raises OSError or ValueError when the file exists but can't be read,
+        so a transient failure is never mistaken for an empty schedule.
+        """
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        try:
+            return cls({problems: {int(number): list(item) for number, item in numbers.items()}
+                        for problems, numbers in data.items()})
+        except (AttributeError, TypeError) as e:
+            raise ValueError(f"corrupt drill schedule: {e}") from None
+
+    def to_json(self):
+        return {problems: {str(number): list(item) for number, item in numbers.items()}
+                for problems, numbers in self.items.items()}
+
+    def schedule(self, problems, number, item):
+        self.items.setdefault(problems, {})[number] = item
+        heapq.heappush(self.heaps.setdefault(problems, []), (item[self.DUE], number))
+        self.changed = True
+
+    def next_due(self, problems, before=None):
+        """The most overdue number due by before (default now), or None; it stays scheduled"""
+        before = time.time() if before is None else before
+        heap = self.heaps.get(problems, [])
+        items = self.items.get(problems, {})
+        while heap and items.get(heap[0][1], (None,) * 5)[self.DUE] != heap[0][0]:
+            heapq.heappop(heap)  # Rescheduled since this entry was pushed
+        if heap and heap[0][0] <= before:
+            return heap[0][1]
+        return None
+
+    def is_due(self, problems, number, now=None):
+        item = self.items.get(problems, {}).get(number)
+        return item is not None and item[self.DUE] <= (time.time() if now is None else now)
+
+    def due_count(self, problems, now=None):
+        now = time.time() if now is None else now
+        return sum(item[self.DUE] <= now for item in self.items.get(problems, {}).values())
+
+    def lapse(self, problems, number, now=None):
+        """Record a miss, scheduling number for relearning soon"""
+        now = time.time() if now is None else now
+        item = self.items.get(problems, {}).get(number) or [0.0, DRILL_START_EASE, now, 0, 0]
+        interval = DRILL_RELEARN
+        ease = max(DRILL_MIN_EASE, item[self.EASE] - 0.2)
+        self.schedule(problems, number, [interval, ease, now + interval, 0, item[self.LAPSES] + 1])
+
+    def review(self, problems, number, answer_time, brick_speed, now=None):
+        """Record a correct answer of a scheduled number, graded by its speed"""
+        item = self.items.get(problems, {}).get(number)
+        if item is None:
+            return
+        now = time.time() if now is None else now
+        # SM-2 quality 5, 4 or 3 for quick, steady and slow answers
+        if answer_time <= brick_speed / 4:
+            ease = item[self.EASE] + 0.1
+        elif answer_time <= brick_speed / 2:
+            ease = item[self.EASE]
+        else:
+            ease = max(DRILL_MIN_EASE, item[self.EASE] - 0.14)
+        reviews = item[self.REVIEWS]
+        if reviews == 0:
+            interval = self.DAY
+        elif reviews == 1:
+            interval = 6 * self.DAY
+        else:
+            interval = item[self.INTERVAL] * ease
+        self.schedule(problems, number, [interval, ease, now + interval, reviews + 1,
+                                         item[self.LAPSES]])
+
+
+class DrillPicker:
+    """Deals the numbers due in a DrillSchedule, most overdue first
+
+    Used as a GameEngine picker: answers and misses are graded into the
+    schedule, and numbers missed during the drill are asked again once the
+    due ones are done. pick() returns None when nothing is left, which
+    ends the game.
+    """
+
+    def __init__(self, schedule, problems, now=None):
+        self.schedule = schedule
+        self.problems = problems
+        self.started = time.time() if now is None else now
+        self.retries = collections.deque()
+
+    def remaining(self):
+        due = self.schedule.next_due(self.problems, self.started) is not None
+        return due or bool(self.retries)
+
+    def pick(self, rng):
+        number = self.schedule.next_due(self.problems, self.started)
+        if number is None and self.retries:
+            number = self.retries.popleft()
+        return number
+
+    def record_miss(self, number):
+        self.schedule.lapse(self.problems, number)
+        self.retries.append(number)
+
+    def record_answer(self, number, answer_time, brick_speed):
+        self.schedule.review(self.problems, number, answer_time, brick_speed)
+
+
+class SessionLog:
+    """Append-only event log of one game session
+
+    The first line is a JSON header with the engine arguments (see
+    GameEngine.describe) plus the mode and hardness. Every following line
+    is a compact JSON array [engine_clock, code, *data]:
+
+        s number          brick spawned
+        k key             key typed into the answer entry
+        a answer time     answer submitted, time as measured by the client
+        m number          brick missed
+        p / r             game paused / resumed
+        w numbers         adaptive weights raised for these numbers
+
+    Records are only kept in self.records. For a log with a path, the
+    owner hands batches from take() to append(), which can run on a
+    background thread, so recording a key press never touches the disk.
+    """
+
+    SPAWN = "s"
+    KEY = "k"
+    ANSWER = "a"
+    MISS = "m"
+    PAUSE = "p"
+    RESUME = "r"
+    PRIORITIZE = "w"
+
+    def __init__(self, header, path=None):
+        self.header = header
+        self.path = path
+        self.records = []
+        self.header_taken = False
+
+    def record(self, clock, code, *data):
+        self.records.append([clock, code, *data])
+
+    def take(self):
+        """The lines not yet taken, header first, and forget them"""
+        lines = self.records if self.header_taken else [self.header] + self.records
+        self.records = []
+        self.header_taken = True
+        return lines
+
+    @staticmethod
+    def append(path, lines):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(line, separators=(",", ":")) + "\n" for line in lines))
+
+    @staticmethod
+    def read(path):
+        """Load a log file, returns (header, records)"""
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            records = [json.loads(line) for line in f if line.strip()]
+        return header, records
+
+
+def replay_session(header, records):
+    """Re-run a recorded session headlessly, as fast as the CPU allows
+
+    Answers and pauses are re-applied at their recorded engine times and
+    the resulting spawns and misses are compared with the recording.
+    Returns (engine, mismatches) where mismatches lists the positions
+    at which the replay diverged, empty when it reproduced exactly.
+    """
+    if header.get("max_bricks", 1) > 1:
+        engine = MultiBrickEngine(header["speed"], header["max_number"], header["lives"],
+                                  header["speed_increase"], seed=header["seed"],
+                                  adaptive=header.get("adaptive", False),
+                                  max_bricks=header["max_bricks"],
+                                  problems=header.get("problems", "squares"))
+    else:
+        engine = GameEngine(header["speed"], header["max_number"], header["lives"],
+                            header["speed_increase"], seed=header["seed"],
+                            adaptive=header.get("adaptive", False),
+                            problems=header.get("problems", "squares"))
+    engine.log = SessionLog(header)
+    engine.spawn_brick()  # Every session opens with a brick at time 0
+
+    for clock, code, *data in records:
+        if clock > engine.clock:
+            engine.advance_to(clock)
+        if code == SessionLog.ANSWER:
+            engine.submit_answer(data[0], data[1])
+        elif code in (SessionLog.PAUSE, SessionLog.RESUME):
+            engine.toggle_pause()
+        elif code == SessionLog.PRIORITIZE:
+            engine.prioritize(data[0])
+
+    outcome_codes = (SessionLog.SPAWN, SessionLog.MISS)
+    expected = [tuple(r[1:]) for r in records if r[1] in outcome_codes]
+    replayed = [tuple(r[1:]) for r in engine.log.records if r[1] in outcome_codes]
+    mismatches = [i for i, pair in enumerate(zip(expected, replayed)) if pair[0] != pair[1]]
+    if len(expected) != len(replayed):
+        mismatches.append(min(len(expected), len(replayed)))
+    return engine, mismatches
+
+
+class GameSnapshot:
+    """A game in progress, packed into a few KB to be resumed later
+
+    from_game() captures the engine (single or multi-brick, including its
+    RNG and adaptive weights, so the resumed game deals the bricks the
+    original would have) and the front-end's mode names and latencies.
+    to_bytes() packs the fixed fields with one struct call and the lists
+    as raw arrays; from_bytes() and engine() undo it.
+    """
+
+    MAGIC = b"STB\x02"
+    FIXED = struct.Struct("<4sBddqqqQqqdqdddddqqdd")
+    BRICK_FIELDS = 6  # id, number, lane, start, speed, y per brick
+
+    __slots__ = ("mode", "hardness", "problems", "speed_increase", "adaptive", "paused",
+                 "brick_speed", "base_speed", "max_number", "lives", "starting_lives", "seed",
+                 "level", "correct_answers", "total_time", "current_number", "brick_y",
+                 "brick_start", "brick_elapsed", "respawn_at", "clock", "max_bricks",
+                 "next_brick_id", "next_spawn_at", "gauss_next", "rng_state", "answer_times",
+                 "failed_numbers", "latencies", "weight_numbers", "weights", "bricks", "lane_last")
+
+    @classmethod
+    def from_game(cls, engine, mode, hardness, latencies):
+        snapshot = cls()
+        snapshot.mode, snapshot.hardness = mode, hardness
+        snapshot.problems = engine.problems.name
+        snapshot.speed_increase = engine.speed_increase_mode
+        snapshot.adaptive = engine.picker is not None
+        snapshot.paused = engine.game_paused
+        for name in ("brick_speed", "base_speed", "max_number", "lives", "starting_lives", "seed",
+                     "level", "correct_answers", "total_time", "current_number", "brick_y",
+                     "brick_start", "brick_elapsed", "respawn_at", "clock"):
+            setattr(snapshot, name, getattr(engine, name))
+        version, state, snapshot.gauss_next = engine.rng.getstate()
+        snapshot.rng_state = array.array("I", state)
+        snapshot.answer_times = array.array("d", engine.answer_times)
+        snapshot.failed_numbers = array.array("q", engine.failed_numbers)
+        snapshot.latencies = array.array("d", [t for latency in latencies for t in latency])
+        # Only the weights the picker has moved away from 1
+        snapshot.weight_numbers = array.array("q")
+        snapshot.weights = array.array("d")
+        if engine.picker is not None:
+            for number, weight in sorted(engine.picker.raised.items()):
+                snapshot.weight_numbers.append(number)
+                snapshot.weights.append(weight)
+        snapshot.bricks = array.array("d")
+        snapshot.lane_last = array.array("q")
+        snapshot.max_bricks = snapshot.next_brick_id = 0
+        snapshot.next_spawn_at = 0.0
+        if isinstance(engine, MultiBrickEngine):
+            snapshot.max_bricks = engine.max_bricks
+            snapshot.next_brick_id = engine.next_brick_id
+            snapshot.next_spawn_at = engine.next_spawn_at
+            for brick in engine.bricks.values():
+                snapshot.bricks.extend((brick.id, brick.number, brick.lane, brick.start,
+                                        brick.speed, brick.y))
+            # Lanes whose newest brick is gone are free, like an empty lane
+            snapshot.lane_last.extend(brick.id if brick is not None and brick.id in engine.bricks
+                                      else -1 for brick in engine.lane_last)
+        return snapshot
+
+    def to_bytes(self):
+        flags = (self.speed_increase | self.adaptive << 1 | self.paused << 2 |
+                 (self.current_number is not None) << 3 | (self.respawn_at is not None) << 4)
+        parts = [self.FIXED.pack(
+            self.MAGIC, flags, self.brick_speed, self.base_speed, self.max_number, self.lives,
+            self.starting_lives, self.seed, self.level, self.correct_answers, self.total_time,
+            self.current_number or 0, self.brick_y, self.brick_start, self.brick_elapsed,
+            self.respawn_at or 0.0, self.clock, self.max_bricks, self.next_brick_id,
+            self.next_spawn_at, math.nan if self.gauss_next is None else self.gauss_next)]
+        for text in (self.mode, self.hardness, self.problems):
+            data = text.encode()
+            parts += [struct.pack("<H", len(data)), data]
+        for values in (self.rng_state, self.answer_times, self.failed_numbers, self.latencies,
+                       self.weight_numbers, self.weights, self.bricks, self.lane_last):
+            if sys.byteorder != "little":
+                values = array.array(values.typecode, values)
+                values.byteswap()
+            parts += [struct.pack("<I", len(values)), values.tobytes()]
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Unpack to_bytes() output; raises ValueError if it isn't a snapshot"""
+        snapshot = cls()
+        try:
+            (magic, flags, snapshot.brick_speed, snapshot.base_speed, snapshot.max_number,
+             snapshot.lives, snapshot.starting_lives, snapshot.seed, snapshot.level,
+             snapshot.correct_answers, snapshot.total_time, current_number, snapshot.brick_y,
+             snapshot.brick_start, snapshot.brick_elapsed, respawn_at, snapshot.clock, snapshot.max_bricks,
+             snapshot.next_brick_id, snapshot.next_spawn_at, gauss_next) = cls.FIXED.unpack_from(data)
+            if magic != cls.MAGIC:
+                raise ValueError("not a saved game")
+            offset = cls.FIXED.size
+            texts = []
+            for _ in range(3):
+                (length,) = struct.unpack_from("<H", data, offset)
+                offset += 2
+                texts.append(data[offset:offset + length].decode())
+                offset += length
+            snapshot.mode, snapshot.hardness, snapshot.problems = texts
+            for name, typecode in (("rng_state", "I"), ("answer_times", "d"),
+                                   ("failed_numbers", "q"), ("latencies", "d"),
+                                   ("weight_numbers", "q"), ("weights", "d"), ("bricks", "d"),
+                                   ("lane_last", "q")):
+                (count,) = struct.unpack_from("<I", data, offset)
+                offset += 4
+                values = array.array(typecode)
+                end = offset + count * values.itemsize
+                if end > len(data):
+                    raise ValueError("truncated saved game")
+                values.frombytes(data[offset:end])
+                if sys.byteorder != "little":
+                    values.byteswap()
+                setattr(snapshot, name, values)
+                offset = end
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f"corrupt saved game: {e}") from None
+        snapshot.speed_increase = bool(flags & 1)
+        snapshot.adaptive = bool(flags & 2)
+        snapshot.paused = bool(flags & 4)
+        snapshot.current_number = current_number if flags & 8 else None
+        snapshot.respawn_at = respawn_at if flags & 16 else None
+        snapshot.gauss_next = None if math.isnan(gauss_next) else gauss_next
+        return snapshot
+
+    def engine(self):
+        """A new engine in the captured state"""
+        args = (self.base_speed, self.max_number, self.lives, self.speed_increase, self.seed,
+                self.adaptive)
+        if self.max_bricks:
+            engine = MultiBrickEngine(*args, max_bricks=self.max_bricks, problems=self.problems)
+        else:
+            engine = GameEngine(*args, problems=self.problems)
+        for name in ("brick_speed", "starting_lives", "level", "correct_answers", "total_time",
+                     "current_number", "brick_y", "brick_start", "brick_elapsed", "respawn_at",
+                     "clock"):
+            setattr(engine, name, getattr(self, name))
+        engine.game_paused = self.paused
+        engine.rng.setstate((3, tuple(self.rng_state), self.gauss_next))
+        engine.answer_times = self.answer_times.tolist()
+        engine.failed_numbers = self.failed_numbers.tolist()
+        for number, weight in zip(self.weight_numbers, self.weights):
+            engine.picker.set_weight(number, weight)
+        if self.max_bricks:
+            engine.next_brick_id = self.next_brick_id
+            engine.next_spawn_at = self.next_spawn_at
+            for i in range(0, len(self.bricks), self.BRICK_FIELDS):
+                brick_id, number, lane, start, speed, y = self.bricks[i:i + self.BRICK_FIELDS]
+                brick = Brick(int(brick_id), int(number), int(lane), start, speed)
+                brick.y = y
+                engine.bricks[brick.id] = brick
+                engine.by_answer.setdefault(engine.problems.answer(brick.number), []).append(brick.id)
+            engine.lane_last = [engine.bricks.get(brick_id) for brick_id in self.lane_last]
+        return engine
+
+    def answer_latencies(self):
+        values = self.latencies
+        return [tuple(values[i:i + 3]) for i in range(0, len(values), 3)]
+
+
+class FrameClock:
+    """Monotonic frame timer for the game loop
+
+    tick() returns the seconds since the previous tick, so the engine moves
+    by real elapsed time however late the Tk callback fired. Deltas longer
+    than max_frame_time (window drags, a suspended machine) are clamped and
+    the excess skipped. Frames that should have been drawn at tick_rate but
+    were not are counted in dropped_frames.
+    """
+
+    def __init__(self, tick_rate=60, max_frame_time=0.25, clock=time.monotonic):
+        self.tick_rate = tick_rate
+        self.frame_time = 1 / tick_rate
+        self.max_frame_time = max_frame_time
+        self.clock = clock
+        self.last_tick = None
+        self.frames = 0
+        self.dropped_frames = 0
+        self.skipped_time = 0
+
+    def reset(self):
+        """Restart timing, e.g. after a pause, without counting the gap"""
+        self.last_tick = self.clock()
+
+    def tick(self):
+        now = self.clock()
+        if self.last_tick is None:
+            self.last_tick = now
+        dt = now - self.last_tick
+        self.last_tick = now
+        self.frames += 1
+
+        if dt > self.max_frame_time:
+            self.skipped_time += dt - self.max_frame_time
+            dt = self.max_frame_time
+
+        # Half a frame of slack absorbs normal scheduler jitter
+        missed = int(dt * self.tick_rate + 0.5) - 1
+        if missed > 0:
+            self.dropped_frames += missed
+        return dt
+
+    def next_delay_ms(self):
+        """Milliseconds to wait so the next tick lands on the frame grid"""
+        spent = self.clock() - self.last_tick
+        return max(1, int((self.frame_time - spent) * 1000))
+
+
+class AnswerTimer:
+    """Nanosecond timing of one brick's answer, excluding paused time
+
+    start() when the brick appears, key() on every keystroke, pause() and
+    resume() around pauses, and finish() on a correct answer, which gives
+    (total, first_key, typing) in seconds: time to submit, time until the
+    first keystroke, and the time from that keystroke to the submit.
+    """
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.start()
+
+    def start(self):
+        self.started = self.clock()
+        self.paused_total = 0
+        self.paused_at = None
+        self.first_key = None
+
+    def elapsed_ns(self):
+        """Active nanoseconds since start(), frozen while paused"""
+        now = self.paused_at if self.paused_at is not None else self.clock()
+        return now - self.started - self.paused_total
+
+    def key(self):
+        if self.first_key is None and self.paused_at is None:
+            self.first_key = self.elapsed_ns()
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = self.clock()
+
+    def resume(self):
+        if self.paused_at is not None:
+            self.paused_total += self.clock() - self.paused_at
+            self.paused_at = None
+
+    def finish(self):
+        total = self.elapsed_ns()
+        first_key = self.first_key if self.first_key is not None else total
+        return total / 1e9, first_key / 1e9, (total - first_key) / 1e9
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of values, p between 0 and 100"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class TclCallCounter:
+    """Stands in for a widget's Tcl interpreter and counts calls through it"""
+
+    def __init__(self, tk_app):
+        self.tk_app = tk_app
+        self.calls = 0
+
+    def call(self, *args):
+        self.calls += 1
+        return self.tk_app.call(*args)
+
+    def eval(self, script):
+        self.calls += 1
+        return self.tk_app.eval(script)
+
+    def __getattr__(self, name):
+        return getattr(self.tk_app, name)
+
+
+class FrameProfiler:
+    """Opt-in frame timing for the game loop
+
+    Collects the wall time of every profiled method call (see profiled()),
+    how late each after() callback fired compared with its requested
+    delay, and the number of Tcl calls issued through the game canvas
+    between frames. summary() feeds the on-canvas overlay and dump()
+    writes the raw samples to JSON.
+    """
+
+    def __init__(self, tcl_counter=None):
+        self.tcl_counter = tcl_counter
+        self.sections = {}  # Method name -> durations in ns
+        self.frame_starts = []  # perf_counter_ns at the start of each frame
+        self.lateness = []  # ms between the requested and actual callback time
+        self.tcl_calls = []  # Tcl calls per frame
+        self.expected_at = None
+        self.last_tcl_calls = 0
+        self.overlay_visible = False
+
+    def add_sample(self, section, duration_ns):
+        self.sections.setdefault(section, []).append(duration_ns)
+
+    def frame_started(self):
+        now = time.perf_counter_ns()
+        self.frame_starts.append(now)
+        if self.expected_at is not None:
+            self.lateness.append((now - self.expected_at) / 1e6)
+            self.expected_at = None
+        if self.tcl_counter is not None:
+            calls = self.tcl_counter.calls
+            self.tcl_calls.append(calls - self.last_tcl_calls)
+            self.last_tcl_calls = calls
+
+    def scheduled(self, delay_ms):
+        self.expected_at = time.perf_counter_ns() + delay_ms * 1_000_000
+
+    def summary(self, window=120):
+        """FPS and frame time stats over the last window frames, as text"""
+        frames = self.sections.get("update_game", [])[-window:]
+        starts = self.frame_starts[-window:]
+        if len(starts) < 2 or not frames:
+            return "profiling..."
+        fps = (len(starts) - 1) / ((starts[-1] - starts[0]) / 1e9)
+        frame_ms = [ns / 1e6 for ns in frames]
+        text = (f"FPS {fps:.1f}  worst {max(frame_ms):.2f}ms  "
+                f"p50 {percentile(frame_ms, 50):.2f}  p95 {percentile(frame_ms, 95):.2f}  "
+                f"p99 {percentile(frame_ms, 99):.2f}ms")
+        lateness = self.lateness[-window:]
+        if lateness:
+            text += f"\nlate p95 {percentile(lateness, 95):.1f}ms  max {max(lateness):.1f}ms"
+        if self.tcl_calls:
+            recent = self.tcl_calls[-window:]
+            text += f"  Tcl/frame {sum(recent) / len(recent):.1f}"
+        return text
+
+    def draw_overlay(self, canvas):
+        canvas.delete("profiler_overlay")
+        if self.overlay_visible:
+            canvas.create_rectangle(4, 4, CANVAS_WIDTH - 4, 40, fill="black", outline="",
+                                    tags="profiler_overlay")
+            canvas.create_text(8, 8, text=self.summary(), anchor="nw", fill="#00FF00",
+                               font=("Courier", 9), tags="profiler_overlay")
+
+    def dump(self, path):
+        data = {
+            "sections_ns": self.sections,
+            "frame_starts_ns": self.frame_starts,
+            "lateness_ms": self.lateness,
+            "tcl_calls_per_frame": self.tcl_calls,
+        }
+        with open(path, "w") as f:
+            json.dump(data, f)
+
+
+def profiled(method):
+    """Record a MentalMathGame method's wall time while profiling is on"""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+        started = time.perf_counter_ns()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.profiler.add_sample(name, time.perf_counter_ns() - started)
+    return wrapper
+
+
+class BrickSprite:
+    """The falling brick as one group of canvas items sharing a tag
+
+    The items are created once per canvas and recycled for every brick:
+    moving it is a single canvas.move() on the tag and showing a new problem
+    is a single itemconfigure() on its text items.
+    """
+
+    def __init__(self, canvas, x=BRICK_X, tag="brick"):
+        self.canvas = canvas
+        self.tag = tag
+        self.text_tag = f"{tag}_text"
+        self.x = x
+        self.y = 0
+        self.visible = False
+        
+        tags = (tag,)
+        text_tags = (tag, self.text_tag)
+        
+        # 3D-looking brick with gradient effect, highlight and shadow
+        canvas.create_rectangle(x, 0, x + BRICK_WIDTH, BRICK_HEIGHT,
+                                fill="#FF6347", outline="#8B0000", width=3,
+                                tags=tags, state="hidden")
+        canvas.create_rectangle(x + 3, 3, x + 97, 15, fill="#FFA07A", outline="",
+                                tags=tags, state="hidden")
+        canvas.create_rectangle(x + 3, 25, x + 97, 37, fill="#CD5C5C", outline="",
+                                tags=tags, state="hidden")
+        
+        # Number text with shadow
+        canvas.create_text(x + 52, 22, text="", font=("Arial", 16, "bold"), fill="#8B0000",
+                           tags=text_tags, state="hidden")
+        canvas.create_text(x + 50, 20, text="", font=("Arial", 16, "bold"), fill="white",
+                           tags=text_tags, state="hidden")
+
+    def show(self, text, y=0, x=None):
+        self.canvas.itemconfigure(self.text_tag, text=text)
+        self.move_to(y, x)
+        self.canvas.itemconfigure(self.tag, state="normal")
+        self.visible = True
+
+    def move_to(self, y, x=None):
+        dx = 0 if x is None else x - self.x
+        dy = y - self.y
+        if dx or dy:
+            self.canvas.move(self.tag, dx, dy)
+            self.x += dx
+            self.y = y
+
+    @staticmethod
+    def move_many(canvas, moves):
+        """Move several sprites to new heights in a single Tcl round trip
+
+        moves is an iterable of (sprite, y) pairs.
+        """
+        path = str(canvas)
+        script = []
+        for sprite, y in moves:
+            dy = y - sprite.y
+            if dy:
+                script.append(f"{path} move {sprite.tag} 0 {dy!r}")
+                sprite.y = y
+        if script:
+            canvas.tk.eval("\n".join(script))
+
+    def hide(self):
+        if self.visible:
+            self.canvas.itemconfigure(self.tag, state="hidden")
+            self.visible = False
+
+    def center(self):
+        return self.x + BRICK_WIDTH / 2, self.y + BRICK_HEIGHT / 2
+
+
+def build_background_scene(rng):
+    """Describe the retro city backdrop as a list of drawing primitives
+
+    Each entry is ("rect", x1, y1, x2, y2, fill, outline, width) or
+    ("roof", x1, y1, x2, y2, fill, outline, width) for the triangular
+    roofs. rng decides which windows are lit, so equal seeds give equal
+    scenes.
+    """
+    scene = []
+    
+    # Retro-style sky with pixel-art gradient
+    for i, color in enumerate(SKY_COLORS):
+        scene.append(("rect", 0, i * 65, CANVAS_WIDTH, (i + 1) * 65, color, "", 0))
+    
+    # Add retro clouds with pixel-style
+    cloud_positions = [(80, 80), (200, 60), (320, 100), (150, 120)]
+    for x, y in cloud_positions:
+        scene.append(("rect", x, y, x+40, y+20, "white", "#CCCCCC", 1))
+        scene.append(("rect", x+10, y-10, x+30, y+10, "white", "#CCCCCC", 1))
+        scene.append(("rect", x+20, y-15, x+35, y+5, "white", "#CCCCCC", 1))
+    
+    # Retro-style grass with pixel texture
+    scene.append(("rect", 0, 400, CANVAS_WIDTH, CANVAS_HEIGHT, "#228B22", "", 0))
+    for i in range(0, CANVAS_WIDTH, 15):
+        scene.append(("rect", i, 400, i + 8, CANVAS_HEIGHT, "#32CD32", "", 0))
+        scene.append(("rect", i+8, 405, i + 15, CANVAS_HEIGHT, "#006400", "", 0))
+    
+    # Enhanced retro buildings with more detail and pixel-art style
+    buildings = [
+        (30, 280, 80, 400),
+        (100, 240, 140, 400),
+        (160, 300, 200, 400),
+        (280, 260, 330, 400),
+        (350, 290, 390, 400)
+    ]
+    
+    colors = ["#696969", "#778899", "#2F4F4F", "#483D8B", "#8B4513"]
+    
+    for i, (x1, y1, x2, y2) in enumerate(buildings):
+        scene.append(("rect", x1, y1, x2, y2, colors[i], "black", 2))
+        
+        # Add vertical lines for texture
+        for line_x in range(x1 + 10, x2, 8):
+            scene.append(("rect", line_x, y1, line_x + 1, y2, "black", "", 0))
+        
+        # Retro-style roof
+        roof_color = "#8B0000" if i % 2 == 0 else "#4B0082"
+        scene.append(("roof", x1-5, y1-20, x2+5, y1, roof_color, "black", 2))
+        
+        # Pixel-style windows with retro glow
+        for wx in range(x1 + 8, x2 - 8, 15):
+            for wy in range(y1 + 15, y2 - 15, 20):
+                if rng.random() > 0.3:
+                    # Lit window with glow effect
+                    scene.append(("rect", wx, wy, wx + 8, wy + 8, "#FFFF00", "black", 1))
+                    scene.append(("rect", wx+1, wy+1, wx + 7, wy + 7, "#FFFF88", "", 0))
+                else:
+                    # Dark window
+                    scene.append(("rect", wx, wy, wx + 8, wy + 8, "#000080", "black", 1))
+    
+    # Add retro stars in the sky
+    star_positions = [(60, 50), (150, 40), (250, 70), (350, 45), (400, 65)]
+    for sx, sy in star_positions:
+        scene.append(("rect", sx, sy, sx+3, sy+3, "white", "", 0))
+        scene.append(("rect", sx+1, sy-2, sx+2, sy+5, "white", "", 0))
+        scene.append(("rect", sx-2, sy+1, sx+5, sy+2, "white", "", 0))
+    
+    return scene
+
+
+def _fill_pixels(image, x1, y1, x2, y2, color):
+    # PhotoImage.put tiles a single color over [x1, x2) x [y1, y2)
+    x1, y1 = max(0, int(x1)), max(0, int(y1))
+    x2, y2 = min(CANVAS_WIDTH, int(x2)), min(CANVAS_HEIGHT, int(y2))
+    if x2 > x1 and y2 > y1:
+        image.put(color, to=(x1, y1, x2, y2))
+
+
+def background_cache_path(seed):
+    """Where the backdrop baked for seed is cached as a PNG"""
+    return os.path.join(BACKGROUND_CACHE_DIR, f"background_v{BACKGROUND_RENDER_VERSION}_{seed}.png")
+
+
+def render_background(image, scene):
+    """Rasterize a scene from build_background_scene() into a PhotoImage"""
+    _fill_pixels(image, 0, 0, CANVAS_WIDTH, CANVAS_HEIGHT, "#87CEEB")
+    for kind, x1, y1, x2, y2, fill, outline, width in scene:
+        if kind == "rect":
+            _fill_pixels(image, x1, y1, x2, y2, fill)
+            if outline:
+                # Outlines straddle the edge like canvas rectangle outlines
+                lo, hi = width // 2, width - width // 2
+                _fill_pixels(image, x1 - lo, y1 - lo, x2 + hi, y1 + hi, outline)
+                _fill_pixels(image, x1 - lo, y2 - lo, x2 + hi, y2 + hi, outline)
+                _fill_pixels(image, x1 - lo, y1 - lo, x1 + hi, y2 + hi, outline)
+                _fill_pixels(image, x2 - lo, y1 - lo, x2 + hi, y2 + hi, outline)
+        elif kind == "roof":
+            # Isosceles triangle with its apex centered above the base,
+            # filled one scanline at a time
+            mid = (x1 + x2) / 2
+            height = y2 - y1
+            for row in range(height + 1):
+                half = (x2 - x1) / 2 * row / height
+                left, right = mid - half, mid + half
+                _fill_pixels(image, left, y1 + row, right + 1, y1 + row + 1, fill)
+                if outline:
+                    _fill_pixels(image, left - width, y1 + row, left + 1, y1 + row + 1, outline)
+                    _fill_pixels(image, right, y1 + row, right + width + 1, y1 + row + 1, outline)
+            if outline:
+                _fill_pixels(image, x1 - 1, y2 - 1, x2 + 2, y2 + 1, outline)
+
+
+def background_color_at(y):
+    """The backdrop's dominant color at canvas height y, for fading into it"""
+    if y < len(SKY_COLORS) * 65:
+        return SKY_COLORS[max(0, int(y // 65))]
+    if y < 400:
+        return "#87CEEB"
+    return "#228B22"
+
+
+def blend_color(start, end, t):
+    """Mix two #RRGGBB colors, t=0 gives start and t=1 gives end"""
+    a = [int(start[i:i + 2], 16) for i in (1, 3, 5)]
+    b = [int(end[i:i + 2], 16) for i in (1, 3, 5)]
+    return "#%02X%02X%02X" % tuple(round(x + (y - x) * t) for x, y in zip(a, b))
+
+
+class ParticleSystem:
+    """Brick explosion debris drawn from a fixed pool of canvas rectangles
+
+    The pool is created once per canvas and advanced by update() from the
+    main game tick, so fast answers never pile up timer chains or canvas
+    items. When the budget is exhausted the oldest particles are reused.
+    Canvas items have no alpha, so particles fade by blending their color
+    into the backdrop beneath them in fade_steps steps.
+    """
+
+    def __init__(self, canvas, budget=32, lifetime=1.5, fade_steps=6, size=10):
+        self.canvas = canvas
+        self.lifetime = lifetime
+        self.fade_steps = fade_steps
+        self.half = size / 2
+        self.free = [canvas.create_rectangle(0, 0, size, size, fill="#FF6347", outline="black",
+                                             state="hidden", tags="particle")
+                     for _ in range(budget)]
+        self.live = []  # [item, x, y, vx, vy, age, fade_level, color]
+
+    def burst(self, x, y, count=8, speed=60.0, color="#FF6347"):
+        """Throw count particles out of (x, y) at speed pixels per second"""
+        for i in range(count):
+            if self.free:
+                item = self.free.pop()
+            elif self.live:
+                item = self.live.pop(0)[0]  # Recycle the oldest
+            else:
+                return
+            angle = math.radians(i * 360 / count)
+            self.canvas.itemconfigure(item, state="normal", fill=color, outline="black")
+            self.canvas.coords(item, x - self.half, y - self.half, x + self.half, y + self.half)
+            self.live.append([item, x, y, math.cos(angle) * speed, math.sin(angle) * speed,
+                              0.0, 0, color])
+
+    def update(self, dt):
+        still_live = []
+        for particle in self.live:
+            item, x, y, vx, vy, age, fade_level, color = particle
+            age += dt
+            if age >= self.lifetime:
+                self.canvas.itemconfigure(item, state="hidden")
+                self.free.append(item)
+                continue
+            
+            x += vx * dt
+            y += vy * dt
+            self.canvas.coords(item, x - self.half, y - self.half, x + self.half, y + self.half)
+            
+            # Only touch the colors when the fade moves to its next step
+            level = int(age / self.lifetime * self.fade_steps)
+            if level != fade_level:
+                behind = background_color_at(y)
+                t = level / self.fade_steps
+                self.canvas.itemconfigure(item, fill=blend_color(color, behind, t),
+                                          outline=blend_color("#000000", behind, t))
+            particle[1:7] = x, y, vx, vy, age, level
+            still_live.append(particle)
+        self.live = still_live
+
+    def clear(self):
+        for particle in self.live:
+            self.canvas.itemconfigure(particle[0], state="hidden")
+            self.free.append(particle[0])
+        self.live = []
+
+
+def simulate_session(engine, player, dt=1 / 60, max_time=None):
+    """Play a whole game headlessly and return the finished engine
+
+    player(number) returns (answer, seconds_to_answer) for each brick; the
+    answer is submitted once that much simulated time has passed on it.
+    """
+    engine.spawn_brick()
+    answer, delay = player(engine.current_number)
+    while engine.game_active:
+        if max_time is not None and engine.clock >= max_time:
+            break
+        for event in engine.step(dt):
+            if event[0] == "spawn":
+                answer, delay = player(event[1])
+        if engine.current_number is not None and engine.brick_elapsed >= delay:
+            if not engine.submit_answer(answer):
+                delay = float("inf")  # Wrong answers wait for the brick to land
+    return engine
+
+
+class PerformanceStore:
+    """Lifetime per-number results for each player, kept in SQLite
+
+    One row per (player, number) holds attempt and miss counts plus running
+    latency aggregates. Each brick is a single UPSERT on that row, so
+    recording stays constant-time however long the history grows.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS number_stats (
+            player TEXT NOT NULL,
+            number INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            misses INTEGER NOT NULL DEFAULT 0,
+            answered INTEGER NOT NULL DEFAULT 0,
+            total_time REAL NOT NULL DEFAULT 0,
+            total_time_sq REAL NOT NULL DEFAULT 0,
+            best_time REAL,
+            last_played REAL,
+            PRIMARY KEY (player, number)
+        ) WITHOUT ROWID
+    """
+
+    def __init__(self, path=PERFORMANCE_DB, player=None):
+        self.player = player or getpass.getuser()
+        # Autocommit: every brick is its own small transaction
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(self.SCHEMA)
+
+    def record_answer(self, number, answer_time):
+        self.db.execute(
+            """INSERT INTO number_stats (player, number, attempts, answered, total_time,
+                                         total_time_sq, best_time, last_played)
+               VALUES (?, ?, 1, 1, ?, ?, ?, ?)
+               ON CONFLICT (player, number) DO UPDATE SET
+                   attempts = attempts + 1,
+                   answered = answered + 1,
+                   total_time = total_time + excluded.total_time,
+                   total_time_sq = total_time_sq + excluded.total_time_sq,
+                   best_time = MIN(COALESCE(best_time, excluded.best_time), excluded.best_time),
+                   last_played = excluded.last_played""",
+            (self.player, number, answer_time, answer_time * answer_time, answer_time, time.time()))
+
+    def record_miss(self, number):
+        self.db.execute(
+            """INSERT INTO number_stats (player, number, attempts, misses, last_played)
+               VALUES (?, ?, 1, 1, ?)
+               ON CONFLICT (player, number) DO UPDATE SET
+                   attempts = attempts + 1,
+                   misses = misses + 1,
+                   last_played = excluded.last_played""",
+            (self.player, number, time.time()))
+
+    def weakest_numbers(self, max_number, limit=20, min_misses=0):
+        """Numbers up to max_number ordered by miss rate, then mean time"""
+        return [row[0] for row in self.db.execute(
+            """SELECT number FROM number_stats
+               WHERE player = ? AND number <= ? AND misses >= ?
+               ORDER BY CAST(misses AS REAL) / attempts DESC,
+                        total_time / MAX(answered, 1) DESC
+               LIMIT ?""",
+            (self.player, max_number, min_misses, limit))]
+
+    def close(self):
+        self.db.close()
+
+
+class FileLock:
+    """Exclusive inter-process lock on a side file, held inside a with block"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "a+")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+
+def atomic_write_json(path, data):
+    """Replace path with data as JSON so readers see the old or new file, never half of one"""
+    atomic_write_bytes(path, json.dumps(data).encode())
+
+
+def atomic_write_bytes(path, data):
+    """Replace path with data so readers see the old or new file, never half of one"""
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK  # What open() would have created
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.splitext(path)[1])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)  # mkstemp makes it private to the owner
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class AnswerHistory:
+    """Every answer and miss of every game, stored column by column for analysis
+
+    Each column in COLUMNS is a flat file <name>.bin of fixed-width
+    little-endian values, so load_answer_history() can numpy.memmap it
+    without parsing. Mode, hardness, problem and player names are stored as
+    codes into the category lists kept in schema.json with the column dtypes.
+
+    record() buffers rows in typed arrays on the Tk thread; take_chunk()
+    hands the buffered rows over and write_chunk() appends them to every
+    column under an inter-process lock, first trimming columns a crashed
+    writer left longer than the others.
+    """
+
+    COLUMNS = (
+        ("timestamp", "d"),  # Unix time of the answer or miss
+        ("session", "I"),  # The game's seed
+        ("number", "i"),
+        ("latency", "f"),  # Seconds to answer, NaN for a miss
+        ("correct", "B"),
+        ("level", "i"),  # Level after the answer
+        ("mode", "H"),
+        ("hardness", "H"),
+        ("problems", "H"),
+        ("player", "H"),
+    )
+    CATEGORICAL = ("mode", "hardness", "problems", "player")
+    DTYPES = {"d": "<f8", "I": "<u4", "i": "<i4", "f": "<f4", "B": "u1", "H": "<u2"}
+
+    def __init__(self, directory=ANSWER_HISTORY_DIR):
+        self.directory = directory
+        self.schema_path = os.path.join(directory, "schema.json")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.chunk = self.new_chunk()
+
+    def new_chunk(self):
+        chunk = {name: array.array(code) for name, code in self.COLUMNS
+                 if name not in self.CATEGORICAL}
+        chunk.update((name, []) for name in self.CATEGORICAL)
+        return chunk
+
+    def record(self, session, number, latency, level, mode, hardness, problems, player):
+        """Buffer one row; latency None for a miss"""
+        chunk = self.chunk
+        chunk["timestamp"].append(time.time())
+        chunk["session"].append(session)
+        chunk["number"].append(number)
+        chunk["latency"].append(math.nan if latency is None else latency)
+        chunk["correct"].append(latency is not None)
+        chunk["level"].append(level)
+        chunk["mode"].append(mode)
+        chunk["hardness"].append(hardness)
+        chunk["problems"].append(problems)
+        chunk["player"].append(player)
+
+    def take_chunk(self):
+        """The rows buffered so far, or None; the buffer starts over empty"""
+        if not self.chunk["timestamp"]:
+            return None
+        chunk, self.chunk = self.chunk, self.new_chunk()
+        return chunk
+
+    def column_path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def read_schema(self):
+        try:
+            with open(self.schema_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"columns": {name: self.DTYPES[code] for name, code in self.COLUMNS},
+                    "categories": {name: [] for name in self.CATEGORICAL}}
+
+    def write_chunk(self, chunk):
+        os.makedirs(self.directory, exist_ok=True)
+        with FileLock(self.lock_path):
+            schema = self.read_schema()
+            for name in self.CATEGORICAL:
+                names = schema["categories"][name]
+                codes = {value: code for code, value in enumerate(names)}
+                for value in chunk[name]:
+                    if value not in codes:
+                        codes[value] = len(names)
+                        names.append(value)
+                chunk[name] = array.array("H", [codes[value] for value in chunk[name]])
+            atomic_write_json(self.schema_path, schema)
+
+            # Rows are only complete up to the shortest column
+            rows = self.row_count()
+            for name, code in self.COLUMNS:
+                values = chunk[name]
+                if sys.byteorder != "little":
+                    values.byteswap()
+                with open(self.column_path(name), "ab") as f:
+                    f.truncate(rows * values.itemsize)
+                    f.write(values.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def row_count(self):
+        counts = []
+        for name, code in self.COLUMNS:
+            try:
+                size = os.path.getsize(self.column_path(name))
+            except FileNotFoundError:
+                size = 0
+            counts.append(size // array.array(code).itemsize)
+        return min(counts)
+
+
+def load_answer_history(directory=ANSWER_HISTORY_DIR):
+    """Map the answer history with numpy.memmap, without reading or parsing it
+
+    Returns (columns, categories): columns maps each column name to a
+    read-only array, all of the same length, and categories maps mode,
+    hardness, problems and player to the names their codes index.
+    """
+    if load_numpy() is None:
+        raise RuntimeError("load_answer_history requires NumPy")
+    history = AnswerHistory(directory)
+    schema = history.read_schema()
+    rows = history.row_count()
+    columns = {}
+    for name, dtype in schema["columns"].items():
+        if rows:
+            columns[name] = np.memmap(history.column_path(name), dtype=dtype, mode="r",
+                                      shape=(rows,))
+        else:
+            columns[name] = np.empty(0, dtype=dtype)
+    return columns, schema["categories"]
+
+
+def number_heatmap(columns, categories, max_number, problems="squares", player=None, block=1,
+                   bins=128, fastest=0.05, slowest=60.0):
+    """Lifetime attempts, miss rate and median answer time for every number
+
+    Takes the columns from load_answer_history(), keeps the rows of player
+    (every player's when None) and returns three arrays
+    indexed by cell from 0 to ceil(max_number / block), where cell c holds
+    numbers (c-1) * block + 1 to c * block: attempts, miss rate and median
+    seconds, NaN where there is nothing to show. Blocks keep the per-cell
+    histograms small for large ranges. Each is a few bincount
+    passes over the history, never a Python loop over rows. Medians come
+    from per-number histograms of bins log-spaced answer times between
+    fastest and slowest, interpolated within the median bin, so they stay
+    within a percent or two of the exact value.
+    """
+    size = -(-max_number // block) + 1
+    attempts = np.zeros(size, dtype=np.int64)
+    miss_rate = np.full(size, np.nan)
+    median = np.full(size, np.nan)
+    if problems not in categories.get("problems", []):
+        return attempts, miss_rate, median
+    if player is not None and player not in categories.get("player", []):
+        return attempts, miss_rate, median
+    
+    number = columns["number"]
+    keep = (columns["problems"] == categories["problems"].index(problems)) \
+        & (number >= 1) & (number <= max_number)
+    if player is not None:
+        keep &= columns["player"] == categories["player"].index(player)
+    numbers = (number[keep].astype(np.int64) - 1) // block + 1
+    correct = columns["correct"][keep].astype(bool)
+    attempts = np.bincount(numbers, minlength=size)
+    misses = np.bincount(numbers[~correct], minlength=size)
+    played = attempts > 0
+    miss_rate[played] = misses[played] / attempts[played]
+    
+    # Histogram every number's answer times in one bincount over (number, bin)
+    low, high = math.log(fastest), math.log(slowest)
+    latencies = np.log(np.clip(columns["latency"][keep][correct], fastest, slowest))
+    bin_index = np.minimum(((latencies - low) / (high - low) * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(numbers[correct] * bins + bin_index,
+                         minlength=size * bins).reshape(size, bins)
+    cumulative = counts.cumsum(axis=1)
+    half = cumulative[:, -1] / 2
+    answered = half > 0
+    middle = (cumulative < half[:, None]).sum(axis=1)[answered]
+    rows = np.flatnonzero(answered)
+    below = np.where(middle > 0, cumulative[rows, middle - 1], 0)
+    fraction = (half[answered] - below) / counts[rows, middle]
+    median[answered] = np.exp(low + (middle + fraction) / bins * (high - low))
+    return attempts, miss_rate, median
+
+
+HEATMAP_COLORS = ((0x4C, 0xAF, 0x50), (0xFF, 0xEB, 0x3B), (0xE5, 0x39, 0x35))  # Good to bad
+HEATMAP_EMPTY = (0xE0, 0xE0, 0xE0)
+HEATMAP_CELLS = 10_000  # Larger ranges are shown in blocks of consecutive numbers
+
+
+def heatmap_pixels(values, low, high, columns, cell):
+    """Color values[1:] green to red over [low, high] as a grid of cell-sized squares
+
+    Returns an (height, width, 3) uint8 array laid out row by row, number 1
+    at the top left, with NaN values drawn in HEATMAP_EMPTY.
+    """
+    values = values[1:]
+    rows = -(-len(values) // columns)
+    t = np.clip((values - low) / (high - low) if high > low else values * 0, 0, 1)
+    stops = np.linspace(0, 1, len(HEATMAP_COLORS))
+    rgb = np.empty((rows * columns, 3), dtype=np.uint8)
+    rgb[:] = HEATMAP_EMPTY
+    shown = ~np.isnan(values)
+    for channel in range(3):
+        rgb[:len(values)][shown, channel] = np.interp(
+            t[shown], stops, [color[channel] for color in HEATMAP_COLORS])
+    grid = rgb.reshape(rows, columns, 3)
+    return grid.repeat(cell, axis=0).repeat(cell, axis=1)
+
+
+def ppm_data(pixels):
+    """Binary PPM image data for a (height, width, 3) uint8 array"""
+    height, width, _ = pixels.shape
+    return b"P6 %d %d 255\n" % (width, height) + np.ascontiguousarray(pixels).tobytes()
+
+
+class Leaderboard:
+    """Top scores per "{mode}_{hardness}" key, safe to share between game instances
+
+    Scores are a JSON snapshot {"sequence": n, "scores": {key: [[level,
+    player], ...]}} plus an append-only journal of newer scores, one JSON
+    line [sequence, key, level, player] each. Recording a score appends one
+    line under an inter-process lock and pushes it into a bounded min-heap
+    per key, O(log size). Once the journal passes compact_bytes it is folded
+    into the snapshot, which is replaced atomically before the journal is
+    emptied. Journal lines at or below the snapshot's sequence are already
+    in it and skipped, so a crash between the two steps can't count a score
+    twice. Snapshots from older versions, a bare {key: [level, ...]}, are
+    read as scores without a player name.
+
+    The parsed scores stay cached in memory together with the files'
+    mtimes and sizes; load() only re-reads the disk when another game
+    instance changed them. Ranked lists are cached per key until a new
+    score arrives for that key.
+    """
+
+    def __init__(self, path=LEADERBOARD_FILE, size=LEADERBOARD_SIZE, compact_bytes=64 * 1024):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.lock_path = path + ".lock"
+        self.size = size
+        self.compact_bytes = compact_bytes
+        self.heaps = {}
+        self.ranked_cache = {}
+        self.loaded_signature = None
+        self.sequence = 0  # Of the newest score on disk
+        self.version = 0  # Bumped whenever the in-memory scores change
+
+    @staticmethod
+    def parse_entry(entry):
+        """(level, player) from a stored [level, player], or a bare level in older snapshots"""
+        level, player = entry if isinstance(entry, list) else (entry, "")
+        if not isinstance(level, int) or not isinstance(player, str):
+            raise ValueError(f"invalid leaderboard entry: {entry!r}")
+        return level, player
+
+    def push(self, key, level, player=""):
+        """Insert into the in-memory top scores only"""
+        heap = self.heaps.setdefault(key, [])
+        entry = (level, player)
+        if len(heap) < self.size:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        else:
+            return
+        self.ranked_cache.pop(key, None)
+        self.version += 1
+
+    def signature(self):
+        """(mtime, size) of the snapshot and journal, to spot outside changes"""
+        signature = []
+        for path in (self.path, self.journal_path):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self):
+        """Re-read the disk if it changed since we last looked; caller holds the lock"""
+        if self.signature() != self.loaded_signature:
+            self.read()
+
+    def read(self):
+        """Rebuild the in-memory scores from disk; the caller holds the lock"""
+        self.heaps = {}
+        self.ranked_cache = {}
+        self.version += 1
+        self.loaded_signature = self.signature()
+        self.sequence = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                snapshot = json.load(f)
+            if "scores" in snapshot:
+                self.sequence = snapshot["sequence"]
+                snapshot = snapshot["scores"]
+            for key, entries in snapshot.items():
+                for entry in entries:
+                    self.push(key, *self.parse_entry(entry))
+        folded = self.sequence
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        sequence, key, *entry = json.loads(line)
+                        level, player = self.parse_entry(entry)
+                    except (ValueError, TypeError):
+                        continue  # Torn last line from a crashed writer
+                    if sequence > folded:
+                        self.push(key, level, player)
+                        self.sequence = max(self.sequence, sequence)
+
+    def replace(self, scores):
+        """Adopt scores from another instance's load(), keeping version if unchanged"""
+        if scores == self.scores():
+            return
+        version = self.version
+        self.heaps = {}
+        self.ranked_cache = {}
+        for key, entries in scores.items():
+            for level, player in entries:
+                self.push(key, level, player)
+        self.version = version + 1
+
+    def load(self):
+        """Current scores as {key: [[level, player], ...]}, best first"""
+        if self.signature() != self.loaded_signature:
+            with FileLock(self.lock_path):
+                self.refresh()
+        return self.scores()
+
+    def ranked(self, key):
+        """Cached (level, player) tuples for key, best first; don't modify"""
+        ranked = self.ranked_cache.get(key)
+        if ranked is None:
+            ranked = self.ranked_cache[key] = sorted(self.heaps.get(key, []), reverse=True)
+        return ranked
+
+    def scores(self):
+        return {key: [list(entry) for entry in self.ranked(key)] for key in self.heaps}
+
+    def top(self, key, count):
+        return self.ranked(key)[:count]
+
+    def add_score(self, key, level, player=""):
+        with FileLock(self.lock_path):
+            self.refresh()  # Pick up scores from other instances first
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps([self.sequence + 1, key, level, player]) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.sequence += 1
+            self.push(key, level, player)
+            if os.path.getsize(self.journal_path) > self.compact_bytes:
+                self.compact()
+            self.loaded_signature = self.signature()
+
+    def compact(self):
+        """Fold the journal into the snapshot; the caller holds the lock"""
+        self.read()
+        self.write_snapshot()
+
+    def write_snapshot(self):
+        """Replace the snapshot with the scores in memory, then empty the journal"""
+        atomic_write_json(self.path, {"sequence": self.sequence, "scores": self.scores()})
+        open(self.journal_path, "w").close()
+        self.loaded_signature = self.signature()
+
+    def save(self, scores):
+        """Replace every stored score with scores"""
+        with FileLock(self.lock_path):
+            self.refresh()  # The snapshot's sequence must cover every journal line
+            self.heaps = {}
+            self.ranked_cache = {}
+            self.version += 1
+            for key, entries in scores.items():
+                for entry in entries:
+                    self.push(key, *self.parse_entry(entry))
+            self.write_snapshot()
+
+
+class PlayerModel:
+    """Statistical model of how long a player takes to answer a brick
+
+    Answer times are log-normal around a median that grows with the number
+    of digits to type: base_time + digit_time * len(str(n ** 2)). spread is
+    the sigma of the log-normal and error_rate the chance of a wrong answer,
+    which costs the brick like a timeout does.
+    """
+
+    def __init__(self, base_time=1.5, digit_time=0.6, spread=0.35, error_rate=0.03):
+        self.base_time = base_time
+        self.digit_time = digit_time
+        self.spread = spread
+        self.error_rate = error_rate
+
+    def sample(self, rng, numbers):
+        """Vectorized answer times and correctness for an array of numbers"""
+        digits = np.floor(np.log10(numbers.astype(np.float64) ** 2)) + 1
+        median = self.base_time + self.digit_time * digits
+        times = median * np.exp(rng.standard_normal(numbers.shape) * self.spread)
+        correct = rng.random(numbers.shape) >= self.error_rate
+        return times, correct
+
+
+def simulate_difficulty(speed, max_number, lives=3, speed_increase=False, player=None,
+                        games=1_000_000, max_bricks=2000, seed=None):
+    """Play many games at once as NumPy arrays and summarize how far they get
+
+    Every iteration deals one brick to each game still alive, so the cost
+    is a few array operations per brick rather than per game. Games still
+    alive after max_bricks are reported as censored.
+
+    Returns a dict with mean_level, median_level, p10_level, p90_level,
+    censored (fraction of games hitting max_bricks) and survival, where
+    survival[L] is the fraction of games that reached level L.
+    """
+    if load_numpy() is None:
+        raise RuntimeError("simulate_difficulty requires NumPy")
+    player = player or PlayerModel()
+    rng = np.random.default_rng(seed)
+
+    levels = np.zeros(games, dtype=np.int32)
+    lives_left = np.full(games, lives, dtype=np.int8)
+    alive = np.arange(games)
+
+    for _ in range(max_bricks):
+        if alive.size == 0:
+            break
+        numbers = rng.integers(1, max_number + 1, size=alive.size)
+        times, correct = player.sample(rng, numbers)
+
+        limit = np.full(alive.size, float(speed))
+        if speed_increase:
+            limit *= SPEED_RAMP_FACTOR ** (levels[alive] // SPEED_RAMP_LEVELS)
+        success = correct & (times < limit)
+
+        levels[alive] += success
+        lives_left[alive] -= ~success
+        alive = alive[lives_left[alive] > 0]
+
+    counts = np.bincount(levels)
+    survival = counts[::-1].cumsum()[::-1] / games
+    return {
+        "mean_level": float(levels.mean()),
+        "median_level": float(np.median(levels)),
+        "p10_level": float(np.percentile(levels, 10)),
+        "p90_level": float(np.percentile(levels, 90)),
+        "censored": alive.size / games,
+        "survival": survival,
+    }
+
+
+def difficulty_table(player=None, games=100_000, lives=3, speed_increase=False, seed=None):
+    """simulate_difficulty() for every Speed Mode x Hardness Level pair"""
+    table = {}
+    for mode, speed in SPEED_MODES.items():
+        for hardness, max_number in HARDNESS_LEVELS.items():
+            table[f"{mode}_{hardness}"] = simulate_difficulty(
+                speed, max_number, lives, speed_increase, player, games, seed=seed)
+    return table
+
+
+class PersistenceWorker:
+    """Runs disk writes on a background thread so the Tk thread never waits on I/O
+
+    submit(job, label, key=None) queues job() and returns at once; jobs run
+    one at a time in submission order. A job submitted with a key replaces
+    a queued, not yet started job with the same key and takes its place at
+    the back of the queue, so rapid updates such as settings changes
+    coalesce into a single write of the latest state, still run after
+    everything submitted before them.
+    Exceptions raised by jobs are kept as (label, exception) pairs until
+    take_errors() collects them; report() adds failures found elsewhere.
+    A label is only reported once until one of its jobs succeeds again,
+    so a full disk doesn't raise the same error on every autosave.
+    """
 
-class MentalMathGame:
     def __init__(self):
+        self.pending = {}  # key -> (job, label), in submission order
+        self.sequence = itertools.count()  # Keys for jobs that must not coalesce
+        self.condition = threading.Condition()
+        self.errors = []
+        self.failing = set()  # Labels reported and not yet written successfully
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="persistence", daemon=True)
+        self.thread.start()
+
+    def submit(self, job, label, key=None):
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("persistence worker is closed")
+            if key is None:
+                key = next(self.sequence)
+            self.pending.pop(key, None)  # A coalesced job runs after the ones queued before it
+            self.pending[key] = (job, label)
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return  # Closed and drained
+                job, label = self.pending.pop(next(iter(self.pending)))
+            try:
+                job()
+            except Exception as e:
+                self.report(label, e)
+            else:
+                with self.condition:
+                    self.failing.discard(label)
+
+    def close(self, timeout=None):
+        """Run the remaining jobs, then stop the thread"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def report(self, label, error):
+        with self.condition:
+            if label not in self.failing:
+                self.failing.add(label)
+                self.errors.append((label, error))
+
+    def take_errors(self):
+        with self.condition:
+            errors, self.errors = self.errors, []
+        return errors
+
+
+class RacePlayer:
+    """Server-side state of one connection; small and fixed-size per client"""
+
+    __slots__ = ("name", "writer", "outbox", "standings", "wakeup", "racing", "level",
+                 "misses", "index", "deadline", "last_correct_at", "finished_at")
+
+    def __init__(self, writer):
+        self.name = ""
+        self.writer = writer
+        self.outbox = collections.deque()  # Control messages, at most RACE_OUTBOX_LIMIT
+        self.standings = None  # Only the latest standings wait to be sent
+        self.wakeup = asyncio.Event()
+        self.racing = False
+        self.level = 0
+        self.misses = 0
+        self.index = 0  # Brick of the race sequence the player is on
+        self.deadline = 0
+        self.last_correct_at = 0
+        self.finished_at = None
+
+
+class RaceServer:
+    """Head-to-head races over newline-delimited JSON on TCP
+
+    Clients connect and send {"type": "join", "name": ...}. Once
+    min_players have joined, a countdown runs and every player gets
+    {"type": "start", "seed", "speed", "max_number", "lives", "problems"}. The seed makes
+    every client's GameEngine deal the same brick sequence, which the
+    server also generates to check the reports coming back:
+
+        {"type": "answer", "index": i, "answer": a}   brick i was squared
+        {"type": "miss", "index": i}                  brick i hit the ground
+
+    Reports are stamped with the server's clock, which ranks players on
+    the same level, and a brick that stays unreported past its deadline
+    plus RACE_GRACE counts as a miss. Every standings_interval the
+    standings (top RACE_TOP plus each player's own rank) go out to
+    everyone. Slow readers only ever hold the latest standings and a
+    few control messages, so a stalled client can't grow the server's
+    memory; one that falls RACE_OUTBOX_LIMIT messages behind is dropped.
+    Races repeat for as long as the server runs.
+    """
+
+    def __init__(self, host="127.0.0.1", port=RACE_PORT, speed=SPEED_MODES["Intermediate"],
+                 max_number=HARDNESS_LEVELS["Medium"], lives=3, min_players=2, countdown=5,
+                 standings_interval=0.5, intermission=30, problems="squares"):
+        load_asyncio()
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.max_number = max_number
+        self.lives = lives
+        self.min_players = min_players
+        self.countdown = countdown
+        self.standings_interval = standings_interval
+        self.intermission = intermission  # Seconds between races to look at the results
+        self.problems = problem_generator(problems, max_number)
+        self.players = set()
+        self.joined = None  # asyncio.Event, created in serve() on the running loop
+        self.numbers = []
+        self.rng = None
+        self.started_at = None
+
+    async def serve(self, ready=None):
+        """Accept players and run races until cancelled; ready(port) is called once listening"""
+        self.joined = asyncio.Event()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                            limit=RACE_LINE_LIMIT)
+        async with server:
+            if ready is not None:
+                ready(server.sockets[0].getsockname()[1])
+            while True:
+                await self.run_race()
+
+    def now(self):
+        return asyncio.get_running_loop().time() - self.started_at
+
+    def number(self, index):
+        """Brick index of the race, as dealt by a GameEngine with the race seed"""
+        while len(self.numbers) <= index:
+            self.numbers.append(self.rng.randint(1, self.max_number))
+        return self.numbers[index]
+
+    async def run_race(self):
+        while len([p for p in self.players if p.name]) < self.min_players:
+            self.joined.clear()
+            await self.joined.wait()
+        self.broadcast({"type": "countdown", "seconds": self.countdown})
+        await asyncio.sleep(self.countdown)
+
+        seed = random.randrange(2 ** 32)
+        self.rng = random.Random(seed)
+        self.numbers = []
+        self.started_at = asyncio.get_running_loop().time()
+        racers = [p for p in self.players if p.name]
+        for player in racers:
+            player.racing = True
+            player.level = player.misses = player.index = 0
+            player.last_correct_at = 0
+            player.finished_at = None
+            player.deadline = self.speed
+        self.broadcast({"type": "start", "seed": seed, "speed": self.speed,
+                        "max_number": self.max_number, "lives": self.lives,
+                        "problems": self.problems.name}, racers)
+
+        while any(p.racing for p in racers):
+            await asyncio.sleep(self.standings_interval)
+            now = self.now()
+            for player in racers:
+                # Unreported bricks are misses once the client is clearly late
+                while player.racing and now > player.deadline + RACE_GRACE:
+                    self.miss(player, player.deadline)
+            self.broadcast_standings(racers)
+        self.broadcast_standings(racers, "finished")
+        await asyncio.sleep(self.intermission)
+
+    def miss(self, player, at):
+        player.misses += 1
+        player.index += 1
+        player.deadline = at + self.speed
+        if player.misses >= self.lives:
+            player.racing = False
+            player.finished_at = at
+
+    def report(self, player, message):
+        """Apply an answer or miss report from a racing player"""
+        if not player.racing or message.get("index") != player.index:
+            return  # Stale, duplicate or already called by the server
+        now = self.now()
+        if message["type"] == "miss" or now > player.deadline + RACE_GRACE:
+            self.miss(player, min(now, player.deadline))
+        elif message.get("answer") == self.problems.answer(self.number(player.index)):
+            player.level += 1
+            player.index += 1
+            player.last_correct_at = now
+            player.deadline = now + RESPAWN_DELAY + self.speed
+
+    def ranking(self, racers):
+        # Higher level first, then whoever got there earlier
+        return sorted(racers, key=lambda p: (-p.level, p.last_correct_at))
+
+    def broadcast_standings(self, racers, kind="standings"):
+        ranked = self.ranking(racers)
+        top = json.dumps([[p.name, p.level, p.racing] for p in ranked[:RACE_TOP]])
+        # The shared part is encoded once, only the rank differs per player
+        head = f'{{"type": "{kind}", "players": {len(ranked)}, "top": {top}, "rank": '
+        for rank, player in enumerate(ranked, 1):
+            player.standings = f"{head}{rank}}}\n".encode()
+            player.wakeup.set()
+        spectators = f"{head}null}}\n".encode()
+        in_race = set(ranked)
+        for player in self.players:
+            if player not in in_race:
+                player.standings = spectators
+                player.wakeup.set()
+
+    def broadcast(self, message, players=None):
+        line = (json.dumps(message) + "\n").encode()
+        for player in list(self.players if players is None else players):
+            self.send(player, line)
+
+    def send(self, player, line):
+        if len(player.outbox) >= RACE_OUTBOX_LIMIT:
+            player.writer.close()  # Too far behind; the reader loop cleans up
+            return
+        player.outbox.append(line)
+        player.wakeup.set()
+
+    async def write_loop(self, player):
+        writer = player.writer
+        try:
+            while True:
+                await player.wakeup.wait()
+                player.wakeup.clear()
+                while player.outbox:
+                    writer.write(player.outbox.popleft())
+                if player.standings is not None:
+                    writer.write(player.standings)
+                    player.standings = None
+                # Backpressure: wait for the socket; newer standings replace older meanwhile
+                await writer.drain()
+        except ConnectionError:
+            writer.close()
+
+    async def handle_client(self, reader, writer):
+        player = RacePlayer(writer)
+        self.players.add(player)
+        write_task = asyncio.create_task(self.write_loop(player))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    break  # Longer than RACE_LINE_LIMIT
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    kind = message["type"]
+                except (ValueError, TypeError, KeyError):
+                    break
+                if kind == "join" and not player.name:
+                    player.name = str(message.get("name") or "player")[:RACE_NAME_LIMIT]
+                    self.send(player, (json.dumps({"type": "welcome"}) + "\n").encode())
+                    self.joined.set()
+                elif kind in ("answer", "miss"):
+                    self.report(player, message)
+        except ConnectionError:
+            pass
+        finally:
+            self.players.discard(player)
+            if player.racing:
+                player.racing = False
+                player.finished_at = self.now()
+            write_task.cancel()
+            writer.close()
+
+
+class RaceClient:
+    """Connects the Tk game to a RaceServer from a background thread
+
+    Server messages are put on inbox for the Tk thread to poll, followed
+    by {"type": "closed"} (after {"type": "error"} if connecting or
+    reading failed) when the connection ends. send() may be called from
+    any thread.
+    """
+
+    def __init__(self, host, port, name):
+        load_asyncio()
+        self.host = host
+        self.port = port
+        self.name = name
+        self.inbox = queue.Queue()
+        self.loop = asyncio.new_event_loop()
+        self.writer = None
+        self.thread = threading.Thread(target=self.run, name="race", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.loop.run_until_complete(self.session())
+        except (OSError, ValueError) as e:
+            self.inbox.put({"type": "error", "message": str(e)})
+        finally:
+            self.inbox.put({"type": "closed"})
+            self.loop.close()
+
+    async def session(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.write({"type": "join", "name": self.name})
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            self.inbox.put(json.loads(line))
+        self.writer.close()
+
+    def write(self, message):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write((json.dumps(message) + "\n").encode())
+
+    def send(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self.write, message)
+        except RuntimeError:
+            pass  # Connection already over
+
+    def close(self):
+        try:
+            self.loop.call_soon_threadsafe(lambda: self.writer and self.writer.close())
+        except RuntimeError:
+            pass
+
+
+class LazyWindow:
+    """A modal Toplevel built on first show() and afterwards hidden and re-shown
+
+    build(window) fills the new window and may return a refresh() callable,
+    which runs before every later show() to bring the contents up to date.
+    Closing the window only hides it.
+    """
+
+    def __init__(self, parent, build):
+        self.parent = parent
+        self.build = build
+        self.window = None
+        self.refresh = None
+
+    def show(self):
+        if self.window is None or not self.window.winfo_exists():
+            self.window = tk.Toplevel(self.parent)
+            self.window.withdraw()  # Map it once, fully built
+            self.window.transient(self.parent)
+            self.window.protocol("WM_DELETE_WINDOW", self.hide)
+            self.refresh = self.build(self.window)
+        elif self.refresh is not None:
+            self.refresh()
+        self.window.deiconify()
+        self.window.lift()
+        self.window.grab_set()
+
+    def hide(self):
+        if self.window is not None and self.window.winfo_exists():
+            self.window.grab_release()
+            self.window.withdraw()
+
+
+class MentalMathGame:
+    def __init__(self, profile=False, race=None):
         self.root = tk.Tk()
         self.root.title("Square The Brick!")
         self.root.geometry("600x550")
@@ -19,25 +2502,50 @@ class MentalMathGame:
         # Game variables
         self.game_window = None
         self.canvas = None
-        self.current_brick = None
-        self.current_number = 0
-        self.brick_y = 0
-        self.brick_speed = 0
-        self.base_speed = 0  # Store original speed for speed increase mode
-        self.speed_increase_mode = False
+        self.brick_sprite = None
+        self.lane_sprites = {}
+        self.free_lane_sprites = []
+        self.particles = None
         self.current_mode = None
         self.current_hardness = None
-        self.lives = 0
-        self.level = 0
-        self.game_active = False
-        self.game_paused = False
-        self.start_time = 0
-        self.total_time = 0
-        self.correct_answers = 0
-        self.answer_times = []
-        self.failed_numbers = []
-        
+        self.engine = None  # Headless GameEngine holding the game state
+        self.instant_answer = False
+        self.frame_clock = None
+        self.background_images = {}  # Baked backdrops by seed
+        self.background_png = {}  # Base64 PNGs of the backdrops by seed, read from the disk cache
+        self.performance_store = None  # Opened with the first game, used by the persistence thread
+        self.leaderboard = Leaderboard()
+        # Settings, scores and stats are written in the background; the
+        # persistence thread has its own Leaderboard to append scores with
+        self.persistence = PersistenceWorker()
+        self.disk_leaderboard = Leaderboard()
+        self.answer_history = AnswerHistory()  # Rows buffered here, written by the persistence thread
+        # Empty until load_drill_schedule() has read the saved one, and never saved over it
+        self.drill_schedule = DrillSchedule()
+        self.drill_schedule_loaded = False
+        self.drill_radio = None
+        self.load_drill_schedule()
+        self.persistence.submit(self.load_background_cache, "the background cache")
+        atexit.register(self.shutdown)
+        self.answer_timer = AnswerTimer()
+        self.profiling = profile or self.settings.get("profile", False)
+        self.profiler = None  # FrameProfiler of the current game when profiling
+        self.answer_latencies = []  # (total, first_key, typing) per correct answer
+        # Secondary windows are built on first use, then hidden and re-shown
+        self.manual_window = LazyWindow(self.root, self.build_manual)
+        self.settings_window = LazyWindow(self.root, self.build_settings)
+        self.leaderboard_window = LazyWindow(self.root, self.build_leaderboard)
+
+        self.snapshot_saved = os.path.exists(SNAPSHOT_FILE)  # A game to resume
+        self.snapshot_owner = None  # Engine of the game that wrote it, None if not this run's
+        self.race_client = None  # RaceClient when joining races on a server
+        self.race_status = None
+        self.race_label = None
+
         self.create_start_screen()
+        self.root.after(250, self.report_persistence_errors)
+        if race:
+            self.join_race(*race)
         
     def center_window(self, window, width, height):
         screen_width = window.winfo_screenwidth()
@@ -47,51 +2555,117 @@ class MentalMathGame:
         window.geometry(f"{width}x{height}+{x}+{y}")
         
     def load_settings(self):
-        default_settings = {"lives": 3, "speed_increase": False}
+        default_settings = {"lives": 3, "speed_increase": False, "tick_rate": 60,
+                            "record_sessions": True, "adaptive": False, "player": "",
+                            "particle_budget": 32, "bricks": 1, "instant_answer": False, "profile": False,
+                            "problems": "squares", "answer_history": True}
         try:
             if os.path.exists("game_settings.json"):
                 with open("game_settings.json", "r") as f:
                     loaded = json.load(f)
-                    # Ensure speed_increase exists in loaded settings
-                    if "speed_increase" not in loaded:
-                        loaded["speed_increase"] = False
+                    # Ensure settings added in later versions exist
+                    for key, value in default_settings.items():
+                        loaded.setdefault(key, value)
                     return loaded
         except:
             pass
         return default_settings
     
-    def load_leaderboard(self):
-        default_leaderboard = {}
-        # Create leaderboard for each combination of mode and hardness
-        modes = ["Newbie", "Beginner", "Intermediate", "Expert"]
-        hardness_levels = ["Easy", "Medium", "Hard", "Insane"]
-        
-        for mode in modes:
-            for hardness in hardness_levels:
-                key = f"{mode}_{hardness}"
-                default_leaderboard[key] = []
-        
-        try:
-            if os.path.exists("leaderboard.json"):
-                with open("leaderboard.json", "r") as f:
-                    return json.load(f)
-        except:
-            pass
-        return default_leaderboard
-    
-    def save_leaderboard(self, leaderboard):
-        try:
-            with open("leaderboard.json", "w") as f:
-                json.dump(leaderboard, f)
-        except:
-            pass
+    def reload_leaderboard(self, on_loaded):
+        """Re-read the leaderboard files on the persistence thread, then call on_loaded()
+        
+        The files are shared with other game instances and read under their
+        lock, so the Tk thread never waits on it; scores saved by this game
+        are queued before the read and included.
+        """
+        result = []
+        def load():
+            try:
+                result.append(self.disk_leaderboard.load())
+            except (OSError, ValueError):
+                result.append(None)  # Keep showing the cached scores
+        self.persistence.submit(load, "the leaderboard")
+        
+        def apply():
+            if not result:
+                self.root.after(50, apply)
+                return
+            if result[0] is not None:
+                self.leaderboard.replace(result[0])
+            on_loaded()
+        self.root.after(50, apply)
+        
+    def load_drill_schedule(self):
+        """Read the drill schedule on the persistence thread, then adopt it
+        
+        Until it arrives drills run from the empty schedule, which is never
+        saved. A schedule that can't be read is reported and left unsaved.
+        """
+        result = []
+        def load():
+            try:
+                result.append(DrillSchedule.load())
+            except (OSError, ValueError) as e:
+                result.append(None)
+                raise OSError(f"{DRILL_FILE} could not be read ({e})") from e
+        self.persistence.submit(load, "the drill schedule")
+        
+        def apply():
+            if not result:
+                self.root.after(50, apply)
+            elif result[0] is not None:
+                self.drill_schedule = result[0]
+                self.drill_schedule_loaded = True
+                self.update_drill_option()
+        self.root.after(50, apply)
+        
+    def load_background_cache(self):
+        """Read the cached backdrop PNGs into background_png; runs on the persistence thread"""
+        for seed in range(BACKGROUND_VARIANTS):
+            try:
+                with open(background_cache_path(seed), "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue  # Not cached yet, drawn and cached on first use
+            self.background_png.setdefault(seed, base64.b64encode(data).decode("ascii"))
         
     def save_settings(self):
-        try:
-            with open("game_settings.json", "w") as f:
-                json.dump(self.settings, f)
-        except:
-            pass
+        snapshot = dict(self.settings)
+        self.persistence.submit(lambda: atomic_write_json("game_settings.json", snapshot),
+                                "settings", key="settings")
+        self.update_drill_option()  # The problem type may have changed
+        
+    def report_persistence_errors(self):
+        """Show background write failures; polls itself every 250 ms
+        
+        While bricks are falling a dialog would let them land unanswered
+        behind it, so the failure goes in the message line instead.
+        """
+        errors = self.persistence.take_errors()
+        if errors:
+            message = "\n".join(f"Could not save {label}: {error}" for label, error in errors)
+            print(message, file=sys.stderr)
+            if self.game_window and self.engine.game_active and not self.engine.game_paused:
+                labels = ", ".join(label for label, error in errors)
+                self.message_label.config(text=f"Could not save {labels}")
+            else:
+                parent = self.game_window if self.game_window else self.root
+                messagebox.showerror("Save Failed", message, parent=parent)
+        self.root.after(250, self.report_persistence_errors)
+        
+    def shutdown(self):
+        """Finish every queued write; runs at exit"""
+        if self.persistence.closed:
+            return
+        if self.engine and self.engine.game_active:
+            self.save_snapshot()  # The window was closed mid-game
+        self.flush_session_log()
+        self.flush_answer_history()
+        self.save_drill_schedule()
+        self.persistence.submit(self.close_performance_store, "lifetime stats")
+        self.persistence.close()
+        for label, error in self.persistence.take_errors():
+            print(f"Could not save {label}: {error}", file=sys.stderr)
             
     def create_start_screen(self):
         # Clear the window
@@ -132,6 +2706,13 @@ class MentalMathGame:
                                value=mode_name, font=("Arial", 10), bg="#F5F5F5",
                                activebackground="#F5F5F5", selectcolor="#E0E0E0")
             rb.pack(anchor="w", pady=2)
+        
+        # Spaced repetition of missed numbers; labelled by update_drill_option()
+        self.drill_radio = tk.Radiobutton(mode_frame, variable=self.selected_mode,
+                                          value=DRILL_MODE, font=("Arial", 10), bg="#F5F5F5",
+                                          activebackground="#F5F5F5", selectcolor="#E0E0E0")
+        self.drill_radio.pack(anchor="w", pady=2)
+        self.update_drill_option()
             
         # Hardness selection
         hardness_frame = tk.LabelFrame(selection_frame, text="Hardness Level", font=("Arial", 12, "bold"),
@@ -183,9 +2764,33 @@ class MentalMathGame:
         start_canvas.config(cursor="hand2")
         start_canvas.focus_set()  # Make it focusable
         
+        # Resume button, shown by update_resume_button() while a game is saved
+        resume_canvas = self.resume_canvas = tk.Canvas(self.root, width=220, height=50, bg="#F5F5F5",
+                                                       highlightthickness=0)
+        resume_canvas.create_rectangle(10, 5, 210, 45, fill="#d35400", outline="#a04000", width=3)
+        resume_canvas.create_rectangle(12, 7, 208, 20, fill="#e67e22", outline="")  # Highlight
+        resume_canvas.create_text(110, 25, text="RESUME GAME", font=("Arial", 12, "bold"), fill="white")
+        
+        def on_resume_click(event):
+            resume_canvas.delete("hover")  # Remove hover effect first
+            resume_canvas.create_rectangle(10, 5, 210, 45, fill="#a04000", outline="#6e2c00", width=3, tags="pressed")
+            resume_canvas.after(50, lambda: [resume_canvas.delete("pressed"), self.resume_game()])
+        
+        def on_resume_enter(event):
+            resume_canvas.create_rectangle(12, 7, 208, 43, fill="#f0932b", outline="", tags="hover")
+        
+        def on_resume_leave(event):
+            resume_canvas.delete("hover")
+        
+        resume_canvas.bind("<Button-1>", on_resume_click)
+        resume_canvas.bind("<Enter>", on_resume_enter)
+        resume_canvas.bind("<Leave>", on_resume_leave)
+        resume_canvas.config(cursor="hand2")
+        
         # Settings and Leaderboard buttons - macOS compatible
-        buttons_frame = tk.Frame(self.root, bg="#F5F5F5")
+        buttons_frame = self.menu_buttons_frame = tk.Frame(self.root, bg="#F5F5F5")
         buttons_frame.pack(pady=15)
+        self.update_resume_button()
         
         # Manual button canvas (new)
         manual_canvas = tk.Canvas(buttons_frame, width=120, height=50, bg="#F5F5F5", highlightthickness=0)
@@ -271,20 +2876,65 @@ class MentalMathGame:
         leaderboard_canvas.config(cursor="hand2")
         leaderboard_canvas.focus_set()
         
+    def update_drill_option(self):
+        """Show how many numbers today's drill holds, disabled when none are due"""
+        if self.drill_radio is None or not self.drill_radio.winfo_exists():
+            return
+        due = self.drill_schedule.due_count(self.settings.get("problems", "squares"))
+        if due:
+            self.drill_radio.config(text=f"Today's drill ({due} due)", state="normal")
+        else:
+            self.drill_radio.config(text="Today's drill (none due)", state="disabled")
+            if self.selected_mode.get() == DRILL_MODE:
+                self.selected_mode.set("Beginner")
+        
+    def start_drill(self):
+        """Play the numbers due for review, most overdue first, until none are left"""
+        problems = self.settings.get("problems", "squares")
+        picker = DrillPicker(self.drill_schedule, problems)
+        if not picker.remaining():
+            messagebox.showinfo("Today's Drill", "Nothing is due for review. Missed numbers "
+                                "are scheduled here for practice.")
+            self.update_drill_option()
+            return
+        # The answer table has to cover every scheduled number. A number names
+        # the same problem in every range, so this asks what was missed
+        max_number = max(self.drill_schedule.items[problems])
+        self.start_game(SPEED_MODES["Beginner"], DRILL_MODE, max_number, DRILL_MODE,
+                        problems=problems, picker=picker)
+        
+    def record_drill(self, number, answer_time=None):
+        """Schedule a number missed in any game; answers count as reviews once due"""
+        if self.current_mode == DRILL_MODE:
+            return  # The drill's own picker grades its answers
+        problems = self.engine.problems.name
+        if answer_time is None:
+            self.drill_schedule.lapse(problems, number)
+        elif self.drill_schedule.is_due(problems, number):
+            self.drill_schedule.review(problems, number, answer_time, self.engine.brick_speed)
+            
+    def save_drill_schedule(self):
+        """Queue the schedule to be written if a drill result changed it"""
+        if not self.drill_schedule_loaded or not self.drill_schedule.changed:
+            return
+        self.drill_schedule.changed = False
+        data = self.drill_schedule.to_json()
+        self.persistence.submit(lambda: atomic_write_json(DRILL_FILE, data), "the drill schedule",
+                                key="drill")
+        
     def start_game_with_selections(self):
         mode = self.selected_mode.get()
         hardness = self.selected_hardness.get()
         
+        if mode == DRILL_MODE:
+            self.start_drill()
         # Handle custom inputs
-        if mode == "Custom" or hardness == "Custom":
+        elif mode == "Custom" or hardness == "Custom":
             self.show_custom_dialog(mode, hardness)
         else:
             # Get speed and max number from selections
-            speed_map = {"Newbie": 20, "Beginner": 12, "Intermediate": 8, "Expert": 4}
-            hardness_map = {"Easy": 100, "Medium": 250, "Hard": 500, "Insane": 1000}
-            
-            speed = speed_map[mode]
-            max_number = hardness_map[hardness]
+            speed = SPEED_MODES[mode]
+            max_number = HARDNESS_LEVELS[hardness]
             
             self.start_game(speed, mode, max_number, hardness)
         
@@ -302,19 +2952,18 @@ class MentalMathGame:
             speed_entry.pack(pady=5)
             speed_entry.focus()
         else:
-            speed_map = {"Newbie": 20, "Beginner": 12, "Intermediate": 8, "Expert": 4}
-            speed = speed_map[mode]
+            speed = SPEED_MODES[mode]
             speed_entry = None
             
         if hardness == "Custom":
-            tk.Label(dialog, text="Enter max number (1-9999):", font=("Arial", 12)).pack(pady=10)
+            tk.Label(dialog, text=f"Enter max number (1-{MAX_CUSTOM_NUMBER}):",
+                     font=("Arial", 12)).pack(pady=10)
             hardness_entry = tk.Entry(dialog, font=("Arial", 14), width=10)
             hardness_entry.pack(pady=5)
             if mode != "Custom":
                 hardness_entry.focus()
         else:
-            hardness_map = {"Easy": 100, "Medium": 250, "Hard": 500, "Insane": 1000}
-            max_number = hardness_map[hardness]
+            max_number = HARDNESS_LEVELS[hardness]
             hardness_entry = None
         
         def submit():
@@ -325,8 +2974,8 @@ class MentalMathGame:
                 if mode == "Custom" and not (1 <= final_speed <= 99):
                     messagebox.showerror("Error", "Speed must be between 1 and 99 seconds")
                     return
-                if hardness == "Custom" and not (1 <= final_max_number <= 9999):
-                    messagebox.showerror("Error", "Max number must be between 1 and 9999")
+                if hardness == "Custom" and not (1 <= final_max_number <= MAX_CUSTOM_NUMBER):
+                    messagebox.showerror("Error", f"Max number must be between 1 and {MAX_CUSTOM_NUMBER}")
                     return
                     
                 dialog.destroy()
@@ -372,12 +3021,12 @@ class MentalMathGame:
         submit_canvas.focus_set()
         
     def show_manual(self):
-        manual_window = tk.Toplevel(self.root)
+        self.manual_window.show()
+        
+    def build_manual(self, manual_window):
         manual_window.title("Square The Brick! - Game Manual")
         manual_window.geometry("700x600")
         self.center_window(manual_window, 700, 600)
-        manual_window.transient(self.root)
-        manual_window.grab_set()
         manual_window.configure(bg="#F5F5DC")  # Beige book-like background
         
         # Create notebook-style manual with pages
@@ -485,10 +3134,14 @@ class MentalMathGame:
             "🔧 BASIC SETTINGS:",
             "• Lives: Set 1-10 lives (default: 3)",
             "• Speed Increase: Enable progressive difficulty",
+            "• Training Mode: Bricks favour squares you miss",
+            "• Bricks at once: Up to 30 bricks in four lanes",
+            "• Instant Answers: Correct digits count without ENTER",
+            "• Problems: Squares, cubes, products or square roots",
             "",
             "🎨 CUSTOM MODES:",
             "• Custom Speed: 1-99 seconds per brick",
-            "• Custom Range: Numbers 1-9999",
+            "• Custom Range: Numbers 1-1000000",
             "",
             "💾 DATA STORAGE:",
             "• Settings saved automatically",
@@ -508,17 +3161,21 @@ class MentalMathGame:
         close_canvas.pack(pady=10)
         
         # Improved button with better contrast and visibility
-        close_canvas.create_rectangle(5, 5, 115, 40, fill="#2C3E50", outline="#1B252F", width=2)
-        close_canvas.create_rectangle(7, 7, 113, 20, fill="#34495E", outline="")  # Highlight
-        close_canvas.create_rectangle(7, 25, 113, 38, fill="#1A252F", outline="")  # Shadow
-        close_canvas.create_text(60, 22, text="Close Manual", font=("Georgia", 10, "bold"), fill="white")
+        def draw_close_button():
+            close_canvas.delete("all")
+            close_canvas.create_rectangle(5, 5, 115, 40, fill="#2C3E50", outline="#1B252F", width=2)
+            close_canvas.create_rectangle(7, 7, 113, 20, fill="#34495E", outline="")  # Highlight
+            close_canvas.create_rectangle(7, 25, 113, 38, fill="#1A252F", outline="")  # Shadow
+            close_canvas.create_text(60, 22, text="Close Manual", font=("Georgia", 10, "bold"), fill="white")
+        draw_close_button()
         
         def on_manual_close_click(event):
             # Immediate response and better visual feedback
             close_canvas.delete("all")
             close_canvas.create_rectangle(5, 5, 115, 40, fill="#1B252F", outline="#0D1117", width=2)
             close_canvas.create_text(60, 22, text="Close Manual", font=("Georgia", 10, "bold"), fill="#CCCCCC")
-            close_canvas.after(50, manual_window.destroy)  # Shorter delay for immediate response
+            # Shorter delay for immediate response; the button is ready for the next opening
+            close_canvas.after(50, lambda: [draw_close_button(), self.manual_window.hide()])
         
         def on_manual_close_enter(event):
             close_canvas.create_rectangle(7, 7, 113, 38, fill="#4A90E2", outline="", tags="hover")
@@ -591,29 +3248,52 @@ class MentalMathGame:
         scrollbar.pack(side="right", fill="y", pady=10)
         
     def show_settings(self):
-        settings_window = tk.Toplevel(self.root)
+        self.settings_window.show()
+        
+    def build_settings(self, settings_window):
         settings_window.title("Game Settings")
-        settings_window.geometry("400x300")
-        self.center_window(settings_window, 400, 300)
-        settings_window.transient(self.root)
-        settings_window.grab_set()
+        settings_window.geometry("400x550")
+        self.center_window(settings_window, 400, 550)
         
         # Number of lives
         tk.Label(settings_window, text="Number of lives (1-10):", font=("Arial", 12)).pack(pady=15)
         lives_entry = tk.Entry(settings_window, font=("Arial", 12), width=10)
         lives_entry.pack(pady=5)
-        lives_entry.insert(0, str(self.settings["lives"]))
         
         # Speed increase mode
         tk.Label(settings_window, text="Speed Increase Mode:", font=("Arial", 12)).pack(pady=(20, 5))
         tk.Label(settings_window, text="(Speed increases 10% every 10 levels)", 
                 font=("Arial", 9), fg="gray").pack()
         
-        speed_increase_var = tk.BooleanVar(value=self.settings.get("speed_increase", False))
+        speed_increase_var = tk.BooleanVar()
         speed_check = tk.Checkbutton(settings_window, text="Enable Speed Increase", 
                                    variable=speed_increase_var, font=("Arial", 11))
         speed_check.pack(pady=10)
         
+        # Training mode
+        adaptive_var = tk.BooleanVar()
+        adaptive_check = tk.Checkbutton(settings_window, text="Training Mode (focus on weak squares)", 
+                                      variable=adaptive_var, font=("Arial", 11))
+        adaptive_check.pack()
+        tk.Label(settings_window, text="(Training games don't count for the leaderboard)", 
+                font=("Arial", 9), fg="gray").pack()
+        
+        # Instant answer mode
+        instant_var = tk.BooleanVar()
+        tk.Checkbutton(settings_window, text="Instant Answers (no ENTER needed)", 
+                      variable=instant_var, font=("Arial", 11)).pack(pady=(10, 0))
+        
+        # Multi-brick mode
+        tk.Label(settings_window, text="Bricks falling at once (1-30):", font=("Arial", 12)).pack(pady=(15, 5))
+        bricks_entry = tk.Entry(settings_window, font=("Arial", 12), width=10)
+        bricks_entry.pack()
+        
+        # Problem type
+        tk.Label(settings_window, text="Problems:", font=("Arial", 12)).pack(pady=(15, 5))
+        problem_labels = {cls.label: name for name, cls in PROBLEM_TYPES.items()}
+        problems_var = tk.StringVar()
+        tk.OptionMenu(settings_window, problems_var, *problem_labels).pack()
+        
         def save_and_close():
             try:
                 lives = int(lives_entry.get())
@@ -621,11 +3301,20 @@ class MentalMathGame:
                 if not (1 <= lives <= 10):
                     messagebox.showerror("Error", "Lives must be between 1 and 10")
                     return
+                
+                bricks = int(bricks_entry.get())
+                if not (1 <= bricks <= 30):
+                    messagebox.showerror("Error", "Bricks must be between 1 and 30")
+                    return
                     
                 self.settings["lives"] = lives
+                self.settings["bricks"] = bricks
                 self.settings["speed_increase"] = speed_increase_var.get()
+                self.settings["adaptive"] = adaptive_var.get()
+                self.settings["instant_answer"] = instant_var.get()
+                self.settings["problems"] = problem_labels[problems_var.get()]
                 self.save_settings()
-                settings_window.destroy()
+                self.settings_window.hide()
                 
             except ValueError:
                 messagebox.showerror("Error", "Please enter a valid number")
@@ -634,6 +3323,23 @@ class MentalMathGame:
             lives_entry.delete(0, tk.END)
             lives_entry.insert(0, "3")
             speed_increase_var.set(False)
+            adaptive_var.set(False)
+            instant_var.set(False)
+            bricks_entry.delete(0, tk.END)
+            bricks_entry.insert(0, "1")
+            problems_var.set(SquareProblems.label)
+        
+        def refresh():
+            # Show the saved settings, dropping edits that were never saved
+            lives_entry.delete(0, tk.END)
+            lives_entry.insert(0, str(self.settings["lives"]))
+            speed_increase_var.set(self.settings.get("speed_increase", False))
+            adaptive_var.set(self.settings.get("adaptive", False))
+            instant_var.set(self.settings.get("instant_answer", False))
+            bricks_entry.delete(0, tk.END)
+            bricks_entry.insert(0, str(self.settings.get("bricks", 1)))
+            problems_var.set(PROBLEM_TYPES[self.settings.get("problems", "squares")].label)
+        refresh()
         
         buttons_frame = tk.Frame(settings_window)
         buttons_frame.pack(pady=30)
@@ -692,16 +3398,18 @@ class MentalMathGame:
         reset_canvas.bind("<Leave>", on_reset_leave)
         reset_canvas.config(cursor="hand2")
         reset_canvas.focus_set()
+        return refresh
         
     def show_leaderboard(self):
-        leaderboard_window = tk.Toplevel(self.root)
+        self.leaderboard_window.show()
+        
+    def build_leaderboard(self, leaderboard_window):
         leaderboard_window.title("Leaderboard")
         leaderboard_window.geometry("600x500")
         self.center_window(leaderboard_window, 600, 500)
-        leaderboard_window.transient(self.root)
-        leaderboard_window.grab_set()
         
-        leaderboard = self.load_leaderboard()
+        # Cached scores now; refresh() below re-reads the files in the background
+        shown_version = self.leaderboard.version
         
         tk.Label(leaderboard_window, text="LEADERBOARD", font=("Arial", 20, "bold")).pack(pady=10)
         tk.Label(leaderboard_window, text="(Default lives setting only: 3 lives)", 
@@ -718,31 +3426,59 @@ class MentalMathGame:
         notebook = ttk.Notebook(leaderboard_window)
         notebook.pack(expand=True, fill="both", padx=20, pady=20)
         
-        modes = ["Newbie", "Beginner", "Intermediate", "Expert"]
-        hardness_levels = ["Easy", "Medium", "Hard", "Insane"]
+        modes = list(SPEED_MODES)
+        hardness_levels = list(HARDNESS_LEVELS)
+        
+        # Tabs are empty frames until first selected, then filled once
+        built_tabs = set()
+        filled_tabs = {}  # Hardness tabs showing scores, emptied when scores change
+        hardness_handlers = []
+        
+        def fill_scores(hardness_frame, key):
+            filled_tabs[str(hardness_frame)] = hardness_frame
+            scores = self.leaderboard.top(key, 5)  # Top 5
+            if scores:
+                for i, (score, player) in enumerate(scores):
+                    rank_text = f"{i+1}. Level {score}" + (f" - {player}" if player else "")
+                    tk.Label(hardness_frame, text=rank_text, font=("Arial", 14)).pack(pady=5)
+            else:
+                tk.Label(hardness_frame, text="No scores yet!", font=("Arial", 14), fg="gray").pack(pady=20)
         
-        for mode in modes:
-            mode_frame = ttk.Frame(notebook)
-            notebook.add(mode_frame, text=mode)
-            
+        def build_mode(mode_frame, mode):
             # Create sub-tabs for hardness levels
             sub_notebook = ttk.Notebook(mode_frame)
             sub_notebook.pack(expand=True, fill="both", padx=10, pady=10)
             
+            hardness_tabs = {}
             for hardness in hardness_levels:
                 hardness_frame = ttk.Frame(sub_notebook)
                 sub_notebook.add(hardness_frame, text=hardness)
-                
-                key = f"{mode}_{hardness}"
-                scores = leaderboard.get(key, [])
-                scores.sort(reverse=True)  # Sort by score (level) descending
-                
-                if scores:
-                    for i, score in enumerate(scores[:5]):  # Top 5
-                        rank_text = f"{i+1}. Level {score}"
-                        tk.Label(hardness_frame, text=rank_text, font=("Arial", 14)).pack(pady=5)
-                else:
-                    tk.Label(hardness_frame, text="No scores yet!", font=("Arial", 14), fg="gray").pack(pady=20)
+                hardness_tabs[str(hardness_frame)] = (hardness_frame, f"{mode}_{hardness}")
+            
+            def on_hardness_selected(event=None):
+                selected = sub_notebook.select()
+                if selected in hardness_tabs and selected not in built_tabs:
+                    built_tabs.add(selected)
+                    fill_scores(*hardness_tabs[selected])
+            
+            sub_notebook.bind("<<NotebookTabChanged>>", on_hardness_selected)
+            hardness_handlers.append(on_hardness_selected)
+            on_hardness_selected()
+        
+        mode_tabs = {}
+        for mode in modes:
+            mode_frame = ttk.Frame(notebook)
+            notebook.add(mode_frame, text=mode)
+            mode_tabs[str(mode_frame)] = (mode_frame, mode)
+        
+        def on_mode_selected(event=None):
+            selected = notebook.select()
+            if selected in mode_tabs and selected not in built_tabs:
+                built_tabs.add(selected)
+                build_mode(*mode_tabs[selected])
+        
+        notebook.bind("<<NotebookTabChanged>>", on_mode_selected)
+        on_mode_selected()
         
         # Fixed close button - macOS compatible
         close_canvas = tk.Canvas(leaderboard_window, width=80, height=35, bg=leaderboard_window.cget('bg'), highlightthickness=0)
@@ -755,7 +3491,7 @@ class MentalMathGame:
         def on_close_click(event):
             close_canvas.delete("hover")  # Remove hover effect first
             close_canvas.create_rectangle(3, 3, 77, 32, fill="#c82333", outline="#bd2130", width=2, tags="pressed")
-            close_canvas.after(50, lambda: [close_canvas.delete("pressed"), leaderboard_window.destroy()])
+            close_canvas.after(50, lambda: [close_canvas.delete("pressed"), self.leaderboard_window.hide()])
         
         def on_close_enter(event):
             close_canvas.create_rectangle(5, 5, 75, 30, fill="#f5626a", outline="", tags="hover")
@@ -772,22 +3508,119 @@ class MentalMathGame:
         close_canvas.config(cursor="hand2")
         close_canvas.focus_set()
         
-    def start_game(self, speed, mode, max_number, hardness):
-        self.brick_speed = speed
-        self.base_speed = speed  # Store original speed
-        self.speed_increase_mode = self.settings.get("speed_increase", False)
+        def redraw():
+            nonlocal shown_version
+            if self.leaderboard.version == shown_version or not leaderboard_window.winfo_exists():
+                return
+            shown_version = self.leaderboard.version
+            # Empty the stale tabs; the selected ones refill now, the rest when picked
+            for tab, hardness_frame in filled_tabs.items():
+                for widget in hardness_frame.winfo_children():
+                    widget.destroy()
+                built_tabs.discard(tab)
+            filled_tabs.clear()
+            for on_hardness_selected in hardness_handlers:
+                on_hardness_selected()
+        
+        def refresh():
+            self.reload_leaderboard(redraw)
+        refresh()
+        return refresh
+        
+    def start_game(self, speed, mode, max_number, hardness, seed=None, lives=None, problems=None,
+                   picker=None):
+        # Races and drills never save, so only other games take the saved game's place
+        resumable = mode not in (RACE_MODE, DRILL_MODE)
+        if resumable and not self.confirm_replace_snapshot():
+            return
         self.current_mode = mode
         self.current_hardness = hardness
-        self.max_number = max_number
-        self.lives = self.settings["lives"]
-        self.level = 0
-        self.correct_answers = 0
-        self.total_time = 0
-        self.answer_times = []
-        self.failed_numbers = []
-        self.game_active = True
-        self.game_paused = False
+        self.close_session_log()
+        # Races are plain single-brick games, dealt from the server's seed
+        racing = mode == RACE_MODE
+        lives = lives or self.settings["lives"]
+        problems = problems or self.settings.get("problems", "squares")
+        if self.settings.get("bricks", 1) > 1 and not racing and picker is None:
+            self.engine = MultiBrickEngine(speed, max_number, lives,
+                                           self.settings.get("speed_increase", False),
+                                           adaptive=self.settings.get("adaptive", False),
+                                           max_bricks=self.settings["bricks"],
+                                           problems=problems)
+        else:
+            self.engine = GameEngine(speed, max_number, lives,
+                                     self.settings.get("speed_increase", False) and not racing,
+                                     seed=seed,
+                                     adaptive=self.settings.get("adaptive", False) and not racing,
+                                     problems=problems)
+            if picker is not None:
+                self.engine.picker = picker
+        self.snapshot_owner = self.engine if resumable else None
+        self.answer_latencies = []
+        # Replays can't rebuild a picker's numbers, so those games aren't logged
+        self.open_game_window(record=self.settings.get("record_sessions", True) and picker is None)
+        self.prioritize_weak_numbers()
+        first_brick = self.engine.spawn_brick()
+        if self.multi_brick:
+            self.show_lane_brick(first_brick)
+        else:
+            self.spawn_new_brick()
+        
+        # Auto-select the answer entry field for immediate typing
+        self.game_window.after(100, self.auto_focus_entry)
+        
+        self.update_game()
         
+    def resume_game(self):
+        """Continue the game saved in SNAPSHOT_FILE, paused until SPACE is pressed"""
+        try:
+            with open(SNAPSHOT_FILE, "rb") as f:
+                snapshot = GameSnapshot.from_bytes(f.read())
+            engine = snapshot.engine()
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            # Gone or corrupt, it can never be resumed
+            messagebox.showerror("Error", f"Could not resume the saved game: {e}")
+            self.delete_snapshot()
+            return
+        except OSError as e:
+            # Possibly a passing failure, so the save is kept for another try
+            messagebox.showerror("Error", f"Could not read the saved game: {e}")
+            return
+        self.current_mode = snapshot.mode
+        self.current_hardness = snapshot.hardness
+        self.close_session_log()
+        self.engine = engine
+        self.snapshot_owner = engine
+        self.engine.game_paused = False  # Paused again once the board is drawn
+        self.answer_latencies = snapshot.answer_latencies()
+        # A replay needs the whole game, so the rest of this one isn't logged
+        self.open_game_window(record=False)
+        
+        # Put the board back as it was
+        if self.multi_brick:
+            for brick in self.engine.bricks.values():
+                self.show_lane_brick(brick)
+        elif self.engine.current_number is not None:
+            self.spawn_new_brick()
+        self.level_label.config(text=str(self.engine.level))
+        self.update_failed_numbers_display()
+        self.engine.game_paused = True
+        self.answer_timer.pause()
+        self.message_label.config(text="PAUSED - Press SPACE to continue")
+        
+    def open_game_window(self, record=True):
+        """Per-game setup shared by new and resumed games, up to the game UI"""
+        self.frame_clock = FrameClock(self.settings.get("tick_rate", 60))
+        if self.current_mode == RACE_MODE:
+            # The server's clock decides misses, skipping time here would fall behind it
+            self.frame_clock.max_frame_time = math.inf
+        self.instant_answer = self.settings.get("instant_answer", False)
+        self.next_autosave = self.engine.clock + AUTOSAVE_INTERVAL
+        if self.snapshot_owner is self.engine:
+            self.resume_canvas.pack_forget()  # This game's saves replace the old one
+        if record:
+            self.open_session_log()
+        self.open_performance_store()
+
         # Create game window
         if self.game_window:
             self.game_window.destroy()
@@ -801,12 +3634,6 @@ class MentalMathGame:
         
         # Create UI elements
         self.create_game_ui()
-        self.spawn_new_brick()
-        
-        # Auto-select the answer entry field for immediate typing
-        self.game_window.after(100, self.auto_focus_entry)
-        
-        self.update_game()
         
     def create_game_ui(self):
         # Main container
@@ -838,7 +3665,7 @@ class MentalMathGame:
         lives_frame.pack(side="right")
         
         self.heart_labels = []
-        for i in range(self.settings["lives"]):
+        for i in range(self.engine.lives):
             heart = tk.Label(lives_frame, text="❤️", font=("Arial", 20), bg="#F0F8FF")
             heart.pack(side="left")
             self.heart_labels.append(heart)
@@ -867,6 +3694,7 @@ class MentalMathGame:
         )
         
         self.failed_canvas.create_window((0, 0), window=self.failed_scrollable_frame, anchor="nw")
+        self.failed_numbers_shown = 0
         self.failed_canvas.configure(yscrollcommand=self.failed_scrollbar.set)
         
         self.failed_canvas.pack(side="left", fill="both", expand=True)
@@ -876,6 +3704,13 @@ class MentalMathGame:
         game_area = tk.Frame(content_frame, bg="#F0F8FF")
         game_area.pack(side="right", fill="both", expand=True)
         
+        # Race standings
+        self.race_label = None
+        if self.current_mode == RACE_MODE:
+            self.race_label = tk.Label(game_area, text="Racing!", font=("Courier", 10),
+                                       justify="left", bg="#F0F8FF")
+            self.race_label.pack()
+        
         # Message area
         self.message_label = tk.Label(game_area, text="", font=("Arial", 14), 
                                      fg="red", height=2, bg="#F0F8FF")
@@ -886,18 +3721,34 @@ class MentalMathGame:
         self.canvas.pack()
         
         # Draw background
-        self.draw_background()
+        self.draw_background(self.engine.seed % BACKGROUND_VARIANTS)
+        self.brick_sprite = BrickSprite(self.canvas)
+        
+        # Count Tcl calls made through the game canvas when profiling
+        if self.profiling:
+            self.canvas.tk = TclCallCounter(self.canvas.tk)
+            self.profiler = FrameProfiler(self.canvas.tk)
+            self.game_window.bind("<F3>", self.toggle_profiler_overlay)
+        else:
+            self.profiler = None
+        self.particles = ParticleSystem(self.canvas, self.settings.get("particle_budget", 32))
+        self.lane_sprites = {}  # Multi-brick mode: brick id -> sprite
+        self.free_lane_sprites = []
         
         # Answer input
         input_frame = tk.Frame(game_area, bg="#F0F8FF")
         input_frame.pack(pady=10)
         
         tk.Label(input_frame, text="Answer:", font=("Arial", 14, "bold"), bg="#F0F8FF").pack(side="left")
+        self.answer_text = tk.StringVar(self.game_window)
         self.answer_entry = tk.Entry(input_frame, font=("Arial", 16), width=15, relief="solid", bd=2,
-                                   highlightthickness=2, highlightcolor="#4A90E2", insertwidth=3)
+                                   highlightthickness=2, highlightcolor="#4A90E2", insertwidth=3,
+                                   textvariable=self.answer_text)
         self.answer_entry.pack(side="left", padx=10)
         self.answer_entry.focus_set()
         self.answer_entry.bind("<Return>", self.check_answer)
+        self.answer_entry.bind("<Key>", self.record_key)
+        self.answer_text.trace_add("write", self.on_answer_changed)
         self.answer_entry.bind("<Button-1>", self.focus_answer_entry)
         self.answer_entry.bind("<FocusIn>", self.on_entry_focus_in)
         self.answer_entry.bind("<FocusOut>", self.on_entry_focus_out)
@@ -906,6 +3757,119 @@ class MentalMathGame:
         self.game_window.bind("<KeyPress-space>", self.toggle_pause)
         self.game_window.focus_set()
         
+    def open_session_log(self):
+        """Start recording the session to session_logs/ for later replay"""
+        header = self.engine.describe()
+        header.update(version=1, mode=self.current_mode, hardness=self.current_hardness,
+                      started=time.time())
+        path = os.path.join(SESSION_LOG_DIR,
+                            f"session_{int(time.time())}_{self.engine.seed}.jsonl")
+        self.engine.log = SessionLog(header, path)  # Written by flush_session_log()
+        
+    def flush_session_log(self):
+        """Queue the session log records since the last flush to be appended"""
+        log = self.engine.log if self.engine else None
+        if log is None or log.path is None:
+            return
+        lines = log.take()
+        if not lines:
+            return
+        
+        def append():
+            os.makedirs(SESSION_LOG_DIR, exist_ok=True)
+            SessionLog.append(log.path, lines)
+        self.persistence.submit(append, "the session log")
+            
+    def player_name(self):
+        if self.settings.get("player"):
+            return self.settings["player"]
+        try:
+            return getpass.getuser()
+        except (OSError, KeyError):
+            return ""
+            
+    def open_performance_store(self):
+        player = self.player_name()
+        
+        def open_store():
+            # Lifetime stats are optional, the game works without them
+            if self.performance_store is None:
+                self.performance_store = PerformanceStore(player=player)
+        self.persistence.submit(open_store, "lifetime stats", key="open_performance_store")
+                
+    def close_performance_store(self):
+        """Close the stats database; call on the persistence thread"""
+        if self.performance_store is not None:
+            self.performance_store.close()
+            self.performance_store = None
+                
+    def record_performance(self, number, answer_time=None):
+        """Queue one brick for the lifetime per-number stats, kept for squares"""
+        if self.engine.problems.name != "squares":
+            return
+        def record():
+            if self.performance_store is None:
+                return
+            try:
+                if answer_time is None:
+                    self.performance_store.record_miss(number)
+                else:
+                    self.performance_store.record_answer(number, answer_time)
+            except sqlite3.Error:
+                self.performance_store = None  # Stop trying until the next game
+                raise
+        self.persistence.submit(record, "lifetime stats")
+            
+    def prioritize_weak_numbers(self):
+        """Weight an adaptive game towards the player's lifetime weakest squares
+        
+        The store is queried on the persistence thread, after it is opened,
+        and the weights are raised once the answer arrives.
+        """
+        engine = self.engine
+        if not isinstance(engine.picker, AdaptiveNumberPicker) or engine.problems.name != "squares":
+            return
+        result = []
+        def query():
+            try:
+                if self.performance_store is not None:
+                    result.append(self.performance_store.weakest_numbers(engine.max_number,
+                                                                         min_misses=1))
+            finally:
+                result.append([])  # Only the first entry is used
+        self.persistence.submit(query, "lifetime stats")
+        
+        def apply():
+            if not result:
+                self.root.after(50, apply)
+            elif self.engine is engine and engine.game_active:
+                engine.prioritize(result[0])
+        self.root.after(50, apply)
+            
+    def record_history(self, number, answer_time=None):
+        """Buffer an answer, or a miss without answer_time, for the answer history"""
+        if self.settings.get("answer_history", True):
+            self.answer_history.record(self.engine.seed, number, answer_time, self.engine.level,
+                                       self.current_mode, self.current_hardness,
+                                       self.engine.problems.name, self.player_name())
+            
+    def flush_answer_history(self):
+        """Queue the buffered answer history rows to be appended to disk"""
+        chunk = self.answer_history.take_chunk()
+        if chunk is not None:
+            self.persistence.submit(lambda: self.answer_history.write_chunk(chunk),
+                                    "the answer history")
+            
+    def close_session_log(self):
+        if self.engine and self.engine.log:
+            self.flush_session_log()
+            self.engine.log = None
+            
+    def record_key(self, event):
+        if self.engine.game_active and not self.engine.game_paused:
+            self.engine.record(SessionLog.KEY, event.char or event.keysym)
+            self.answer_timer.key()
+            
     def auto_focus_entry(self):
         """Automatically focus and select the answer entry field"""
         if hasattr(self, 'answer_entry') and self.answer_entry.winfo_exists():
@@ -916,127 +3880,50 @@ class MentalMathGame:
             self.game_window.focus_force()
             self.answer_entry.focus_force()
         
-    def draw_background(self):
-        # Retro-style sky with pixel-art gradient
-        colors = ["#87CEEB", "#7EC0EE", "#6BB6FF", "#5CACEE", "#4F94CD", "#4682B4"]
-        for i, color in enumerate(colors):
-            y_start = i * 65
-            y_end = (i + 1) * 65
-            self.canvas.create_rectangle(0, y_start, 450, y_end, fill=color, outline="")
-        
-        # Add retro clouds with pixel-style
-        cloud_positions = [(80, 80), (200, 60), (320, 100), (150, 120)]
-        for x, y in cloud_positions:
-            # Pixelated cloud style
-            self.canvas.create_rectangle(x, y, x+40, y+20, fill="white", outline="#CCCCCC")
-            self.canvas.create_rectangle(x+10, y-10, x+30, y+10, fill="white", outline="#CCCCCC")
-            self.canvas.create_rectangle(x+20, y-15, x+35, y+5, fill="white", outline="#CCCCCC")
-        
-        # Retro-style grass with pixel texture
-        self.canvas.create_rectangle(0, 400, 450, 480, fill="#228B22", outline="")
-        # Add pixel-style grass texture
-        for i in range(0, 450, 15):
-            self.canvas.create_rectangle(i, 400, i + 8, 480, fill="#32CD32", outline="")
-            self.canvas.create_rectangle(i+8, 405, i + 15, 480, fill="#006400", outline="")
-        
-        # Enhanced retro buildings with more detail and pixel-art style
-        buildings = [
-            (30, 280, 80, 400),
-            (100, 240, 140, 400),
-            (160, 300, 200, 400),
-            (280, 260, 330, 400),
-            (350, 290, 390, 400)
-        ]
-        
-        colors = ["#696969", "#778899", "#2F4F4F", "#483D8B", "#8B4513"]
+    def draw_background(self, seed=0):
+        """Draw the backdrop as a single image item, baked once per seed
         
-        for i, (x1, y1, x2, y2) in enumerate(buildings):
-            # Building body with pixel-art style
-            self.canvas.create_rectangle(x1, y1, x2, y2, fill=colors[i], outline="black", width=2)
-            
-            # Add vertical lines for texture
-            for line_x in range(x1 + 10, x2, 8):
-                self.canvas.create_line(line_x, y1, line_x, y2, fill="black", width=1)
-            
-            # Retro-style roof
-            roof_color = "#8B0000" if i % 2 == 0 else "#4B0082"
-            self.canvas.create_polygon(x1-5, y1, (x1+x2)//2, y1-20, x2+5, y1, 
-                                     fill=roof_color, outline="black", width=2)
-            
-            # Pixel-style windows with retro glow
-            for wx in range(x1 + 8, x2 - 8, 15):
-                for wy in range(y1 + 15, y2 - 15, 20):
-                    if random.random() > 0.3:
-                        # Lit window with retro glow effect
-                        self.canvas.create_rectangle(wx, wy, wx + 8, wy + 8, 
-                                                   fill="#FFFF00", outline="black")
-                        # Add glow effect
-                        self.canvas.create_rectangle(wx+1, wy+1, wx + 7, wy + 7, 
-                                                   fill="#FFFF88", outline="")
-                    else:
-                        # Dark window
-                        self.canvas.create_rectangle(wx, wy, wx + 8, wy + 8, 
-                                                   fill="#000080", outline="black")
-                        
-        # Add retro stars in the sky
-        star_positions = [(60, 50), (150, 40), (250, 70), (350, 45), (400, 65)]
-        for sx, sy in star_positions:
-            # Create pixelated star
-            self.canvas.create_rectangle(sx, sy, sx+3, sy+3, fill="white", outline="")
-            self.canvas.create_rectangle(sx+1, sy-2, sx+2, sy+5, fill="white", outline="")
-            self.canvas.create_rectangle(sx-2, sy+1, sx+5, sy+2, fill="white", outline="")
+        Cached PNGs are read by the persistence thread at startup and new
+        ones written there, so the Tk thread only decodes and renders.
+        """
+        image = self.background_images.get(seed)
+        if image is None:
+            try:
+                image = tk.PhotoImage(data=self.background_png[seed])
+            except (KeyError, tk.TclError):
+                image = tk.PhotoImage(width=CANVAS_WIDTH, height=CANVAS_HEIGHT)
+                render_background(image, build_background_scene(random.Random(seed)))
+                self.cache_background(seed, image)
+            self.background_images[seed] = image
+        self.canvas.create_image(0, 0, image=image, anchor="nw", tags="background")
+                    
+    def cache_background(self, seed, image):
+        """Queue a freshly rendered backdrop to be written to the disk cache"""
+        try:
+            data = image.tk.call(image.name, "data", "-format", "png")
+        except tk.TclError:
+            return  # The in-memory copy is enough for this run
+        if isinstance(data, str):  # Tk returns PNG data as a byte array, but older versions as base64
+            data = base64.b64decode(data)
+        self.background_png[seed] = base64.b64encode(data).decode("ascii")
+        def write():
+            try:
+                os.makedirs(BACKGROUND_CACHE_DIR, exist_ok=True)
+                atomic_write_bytes(background_cache_path(seed), data)
+            except OSError:
+                pass  # Rendered again next run
+        self.persistence.submit(write, "the background cache", key=("background", seed))
                     
+    @profiled
     def spawn_new_brick(self):
-        if not self.game_active or self.game_paused:
+        if not self.engine.game_active or self.engine.game_paused:
             return
             
-        self.current_number = random.randint(1, self.max_number)
-        self.brick_y = 0
-        self.start_time = time.time()
-        
-        # Clear any existing brick elements
-        if hasattr(self, 'current_brick') and self.current_brick:
-            self.canvas.delete(self.current_brick)
-        if hasattr(self, 'brick_highlight'):
-            self.canvas.delete(self.brick_highlight)
-        if hasattr(self, 'brick_shadow'):
-            self.canvas.delete(self.brick_shadow)
-        if hasattr(self, 'brick_text'):
-            self.canvas.delete(self.brick_text)
-        if hasattr(self, 'brick_text_shadow'):
-            self.canvas.delete(self.brick_text_shadow)
-        
-        # Create new brick at center
-        brick_x = 175  # Center of 450px wide canvas minus half brick width (100/2)
-        
-        # Create 3D-looking brick with gradient effect
-        self.current_brick = self.canvas.create_rectangle(
-            brick_x, self.brick_y, brick_x + 100, self.brick_y + 40,
-            fill="#FF6347", outline="#8B0000", width=3
-        )
-        
-        # Add brick highlight for 3D effect
-        self.brick_highlight = self.canvas.create_rectangle(
-            brick_x + 3, self.brick_y + 3, brick_x + 97, self.brick_y + 15,
-            fill="#FFA07A", outline=""
-        )
-        
-        # Add brick shadow for 3D effect
-        self.brick_shadow = self.canvas.create_rectangle(
-            brick_x + 3, self.brick_y + 25, brick_x + 97, self.brick_y + 37,
-            fill="#CD5C5C", outline=""
-        )
+        number = self.engine.current_number
+        self.answer_timer.start()
         
-        # Add number text with shadow
-        self.brick_text_shadow = self.canvas.create_text(
-            brick_x + 52, self.brick_y + 22, text=str(self.current_number),
-            font=("Arial", 16, "bold"), fill="#8B0000"
-        )
-        
-        self.brick_text = self.canvas.create_text(
-            brick_x + 50, self.brick_y + 20, text=str(self.current_number),
-            font=("Arial", 16, "bold"), fill="white"
-        )
+        # Recycle the brick sprite for the new number
+        self.brick_sprite.show(self.engine.problems.prompt(number), self.engine.brick_y)
         
     def focus_answer_entry(self, event=None):
         """Ensure the answer entry gets focus when clicked"""
@@ -1055,157 +3942,308 @@ class MentalMathGame:
             self.answer_entry.config(highlightbackground="#CCCCCC", bg="#F8F8F8")
     
     def toggle_pause(self, event=None):
-        if not self.game_active:
+        # The race clock doesn't stop for anyone
+        if not self.engine.game_active or self.current_mode == RACE_MODE:
             return
             
-        if self.game_paused:
+        if self.engine.toggle_pause():
+            # Pause
+            self.answer_timer.pause()
+            self.save_snapshot()
+            self.message_label.config(text="PAUSED - Press SPACE to continue")
+        else:
             # Unpause
-            self.game_paused = False
             self.message_label.config(text="")
-            self.start_time = time.time()  # Reset start time
+            self.answer_timer.resume()  # Paused time doesn't count
             self.auto_focus_entry()  # Refocus on answer entry with selection
+            self.frame_clock.reset()  # Don't count the paused time
+            if self.profiler:
+                self.profiler.expected_at = None
             self.update_game()
-        else:
-            # Pause
-            self.game_paused = True
-            self.message_label.config(text="PAUSED - Press SPACE to continue")
             
+    @profiled
     def update_game(self):
-        if not self.game_active or self.game_paused:
+        if not self.engine.game_active or self.engine.game_paused:
             return
+        if self.profiler:
+            self.profiler.frame_started()
             
-        # Move brick down
-        if self.current_brick:
-            self.brick_y += 480 / (self.brick_speed * 60)  # 60 FPS assumption
-            
-            # Update all brick elements
-            brick_x = 175
-            self.canvas.coords(self.current_brick, 
-                             brick_x, self.brick_y, brick_x + 100, self.brick_y + 40)
-            self.canvas.coords(self.brick_highlight,
-                             brick_x + 3, self.brick_y + 3, brick_x + 97, self.brick_y + 15)
-            self.canvas.coords(self.brick_shadow,
-                             brick_x + 3, self.brick_y + 25, brick_x + 97, self.brick_y + 37)
-            self.canvas.coords(self.brick_text, brick_x + 50, self.brick_y + 20)
-            self.canvas.coords(self.brick_text_shadow, brick_x + 52, self.brick_y + 22)
+        # Move brick down by the real time since the last frame
+        dt = self.frame_clock.tick()
+        for event in self.engine.step(dt):
+            self.handle_engine_event(event)
+        if self.engine.game_active and self.engine.clock >= self.next_autosave:
+            self.save_snapshot()
+            self.flush_session_log()
+            self.flush_answer_history()
+        self.particles.update(dt)
             
-            # Check if brick hit the ground
-            if self.brick_y >= 360:  # Ground level minus brick height
-                self.lose_life()
+        # Update all brick elements
+        if self.multi_brick:
+            BrickSprite.move_many(self.canvas, ((self.lane_sprites[brick.id], brick.y)
+                                                for brick in self.engine.bricks.values()))
+        elif self.brick_sprite.visible and self.engine.current_number is not None:
+            self.brick_sprite.move_to(self.engine.brick_y)
                 
         # Schedule next update
-        if self.game_active and not self.game_paused:
-            self.game_window.after(16, self.update_game)  # ~60 FPS
+        if self.engine.game_active and not self.engine.game_paused:
+            delay = self.frame_clock.next_delay_ms()
+            self.game_window.after(delay, self.update_game)
+            if self.profiler:
+                self.profiler.scheduled(delay)
+                if self.profiler.overlay_visible and len(self.profiler.frame_starts) % 15 == 0:
+                    self.profiler.draw_overlay(self.canvas)
+            
+    def save_snapshot(self):
+        """Queue the running game to be written to SNAPSHOT_FILE"""
+        self.next_autosave = self.engine.clock + AUTOSAVE_INTERVAL
+        if self.snapshot_owner is not self.engine:
+            return  # Races can't be resumed, drills restart from the schedule
+        data = GameSnapshot.from_game(self.engine, self.current_mode, self.current_hardness,
+                                      self.answer_latencies).to_bytes()
+        self.persistence.submit(lambda: atomic_write_bytes(SNAPSHOT_FILE, data), "the running game",
+                                key="snapshot")
+        self.snapshot_saved = True
+        
+    def delete_snapshot(self):
+        def delete():
+            try:
+                os.remove(SNAPSHOT_FILE)
+            except FileNotFoundError:
+                pass
+        # Shares the key so a queued save of the finished game is dropped
+        self.persistence.submit(delete, "the running game", key="snapshot")
+        self.snapshot_saved = False
+        self.snapshot_owner = None
+        self.update_resume_button()
+        
+    def confirm_replace_snapshot(self):
+        """Ask before a new game's saves overwrite another game's, True to go ahead"""
+        if not self.snapshot_saved:
+            return True
+        return messagebox.askyesno("Saved Game", "You have a saved game. Starting a new game "
+                                   "will replace it. Start anyway?", parent=self.root)
+        
+    def update_resume_button(self):
+        if self.snapshot_saved:
+            self.resume_canvas.pack(before=self.menu_buttons_frame)
+        else:
+            self.resume_canvas.pack_forget()
+        
+    def toggle_profiler_overlay(self, event=None):
+        if self.profiler:
+            self.profiler.overlay_visible = not self.profiler.overlay_visible
+            self.profiler.draw_overlay(self.canvas)
+            
+    def dump_profile(self):
+        """Write the finished game's profiling samples to profiles/"""
+        if not self.profiler:
+            return
+        path = os.path.join(PROFILE_DIR, f"profile_{int(time.time())}_{self.engine.seed}.json")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            self.profiler.dump(path)
+        except OSError as e:
+            print(f"Could not write profile {path}: {e}", file=sys.stderr)
+        self.profiler = None
+            
+    def join_race(self, host, port):
+        """Connect to a race server; its races start from the start screen"""
+        self.race_client = RaceClient(host, port, self.player_name() or "player")
+        self.race_status = tk.Label(self.root, text=f"Joining the race at {host}:{port}...",
+                                    font=("Arial", 12, "bold"), fg="#2E86AB", bg="#F5F5F5")
+        self.race_status.pack()
+        self.poll_race()
+        
+    def poll_race(self):
+        """Handle messages from the race server; polls itself every 50 ms"""
+        while True:
+            try:
+                message = self.race_client.inbox.get_nowait()
+            except queue.Empty:
+                break
+            if not self.handle_race_message(message):
+                self.race_client = None
+                return
+        self.root.after(50, self.poll_race)
+        
+    def handle_race_message(self, message):
+        """Apply one race server message, False once the connection is over"""
+        kind = message.get("type")
+        if kind == "welcome":
+            self.race_status.config(text="Joined! Waiting for the race to start...")
+        elif kind == "countdown":
+            self.race_status.config(text=f"The race starts in {message['seconds']} seconds!")
+        elif kind == "start":
+            self.race_status.config(text="Racing!")
+            self.start_game(message["speed"], RACE_MODE, message["max_number"],
+                            f"1-{message['max_number']}", seed=message["seed"],
+                            lives=message["lives"], problems=message.get("problems", "squares"))
+        elif kind in ("standings", "finished"):
+            text = self.format_standings(message)
+            if self.race_label is not None and self.race_label.winfo_exists():
+                self.race_label.config(text=text)
+            if kind == "finished":
+                self.race_status.config(text="Race over! " + text.split("\n")[0])
+        elif kind == "error":
+            self.race_status.config(text=f"Race connection failed: {message['message']}")
+        elif kind == "closed":
+            if not self.race_status.cget("text").startswith("Race connection failed"):
+                self.race_status.config(text="Disconnected from the race server")
+            return False
+        return True
+        
+    def format_standings(self, message, shown=5):
+        rank = message.get("rank")
+        players = message["players"]
+        lines = [f"Race: #{rank} of {players}" if rank else f"Race: {players} players"]
+        for i, (name, level, racing) in enumerate(message["top"][:shown], 1):
+            lines.append(f"{i}. {name[:14]:<14} level {level:>3}" + ("" if racing else "  out"))
+        return "\n".join(lines)
+            
+    @property
+    def multi_brick(self):
+        return isinstance(self.engine, MultiBrickEngine)
+        
+    def show_lane_brick(self, brick):
+        """Multi-brick mode: put a pooled sprite on a newly spawned brick"""
+        if self.free_lane_sprites:
+            sprite = self.free_lane_sprites.pop()
+        else:
+            sprite = BrickSprite(self.canvas, LANE_XS[brick.lane],
+                                 tag=f"lane_brick{brick.id}")
+        sprite.show(self.engine.problems.prompt(brick.number), brick.y, LANE_XS[brick.lane])
+        self.lane_sprites[brick.id] = sprite
+        
+    def release_lane_brick(self, brick_id):
+        sprite = self.lane_sprites.pop(brick_id, None)
+        if sprite is not None:
+            sprite.hide()
+            self.free_lane_sprites.append(sprite)
+            
+    def handle_engine_event(self, event):
+        """Reflect an engine event on the Tk widgets"""
+        kind = event[0]
+        if kind == "spawn" and self.multi_brick:
+            self.show_lane_brick(self.engine.bricks[event[2]])
+        elif kind == "spawn":
+            self.spawn_new_brick()
+            self.game_window.after(100, self.auto_focus_entry)
+        elif kind == "miss":
+            self.lose_life(event[1], event[2] if len(event) > 2 else None)
+        elif kind == "game_over":
+            self.game_over()
             
     def check_answer(self, event=None):
-        if not self.game_active or self.game_paused:
+        if not self.engine.game_active or self.engine.game_paused:
             return
             
         try:
             answer = int(self.answer_entry.get())
-            correct_answer = self.current_number ** 2
-            
-            if answer == correct_answer:
-                # Correct answer
-                self.correct_answers += 1
-                self.level += 1
-                self.level_label.config(text=str(self.level))
-                
-                # Apply speed increase if enabled (every 10 levels)
-                if self.speed_increase_mode and self.level % 10 == 0:
-                    self.brick_speed = self.base_speed * (0.9 ** (self.level // 10))
-                
-                # Record time
-                answer_time = time.time() - self.start_time
-                self.answer_times.append(answer_time)
-                self.total_time += answer_time
-                
-                # Clear message
-                self.message_label.config(text="")
-                
-                # Explode brick
-                self.explode_brick()
-                
-                # Clear answer field
-                self.answer_entry.delete(0, tk.END)
-                
-                # Spawn new brick after a short delay and refocus entry
-                self.game_window.after(500, lambda: [self.spawn_new_brick(), self.auto_focus_entry()])
-                
         except ValueError:
-            pass  # Invalid input, ignore
+            return  # Invalid input, ignore
             
-    def explode_brick(self):
-        if not self.current_brick:
-            return
+        self.submit_typed_answer(answer)
+        
+    def submit_typed_answer(self, answer):
+        """Give an answer to the engine and update the widgets, True if correct"""
+        number = self.engine.current_number
+        # Multi-brick mode times each brick with the engine clock
+        latency = None if self.multi_brick else self.answer_timer.finish()
+        resolved = self.engine.submit_answer(answer, latency and latency[0])
+        if resolved:
+            # Correct answer
+            brick_id = None
+            if self.multi_brick:
+                number, brick_id = resolved.number, resolved.id
+            else:
+                self.answer_latencies.append(latency)
+            self.record_performance(number, self.engine.answer_times[-1])
+            self.record_history(number, self.engine.answer_times[-1])
+            self.record_drill(number, self.engine.answer_times[-1])
+            self.level_label.config(text=str(self.engine.level))
+            if self.current_mode == RACE_MODE and self.race_client:
+                index = self.engine.level + len(self.engine.failed_numbers) - 1
+                self.race_client.send({"type": "answer", "index": index, "answer": answer})
             
-        # Get brick position
-        coords = self.canvas.coords(self.current_brick)
-        center_x = (coords[0] + coords[2]) / 2
-        center_y = (coords[1] + coords[3]) / 2
-        
-        # Remove original brick elements
-        self.canvas.delete(self.current_brick)
-        self.canvas.delete(self.brick_highlight)
-        self.canvas.delete(self.brick_shadow)
-        self.canvas.delete(self.brick_text)
-        self.canvas.delete(self.brick_text_shadow)
-        self.current_brick = None
-        
-        # Create explosion pieces
-        pieces = []
-        for i in range(8):
-            angle = i * 45
-            dx = math.cos(math.radians(angle)) * 3
-            dy = math.sin(math.radians(angle)) * 3
+            # Clear message
+            self.message_label.config(text="")
             
-            piece = self.canvas.create_rectangle(
-                center_x - 5, center_y - 5, center_x + 5, center_y + 5,
-                fill="#FF6347", outline="black"
-            )
-            pieces.append((piece, dx, dy, center_x, center_y))
+            # Explode brick
+            self.explode_brick(brick_id)
             
-        # Animate explosion
-        self.animate_explosion(pieces, 0)
-        
-    def animate_explosion(self, pieces, frame):
-        if frame > 30:  # Animation duration
-            for piece, _, _, _, _ in pieces:
-                self.canvas.delete(piece)
-            return
+            # Clear answer field; the engine spawns the next brick shortly
+            self.clear_answer_entry()
+            return True
+        return False
             
-        alpha = 1 - frame / 30  # Fade out
-        
-        for i, (piece, dx, dy, start_x, start_y) in enumerate(pieces):
-            new_x = start_x + dx * frame
-            new_y = start_y + dy * frame
+    def clear_answer_entry(self):
+        self.answer_entry.delete(0, tk.END)
+        self.answer_entry.config(bg="#FFFFFF")
+            
+    def live_answer_texts(self):
+        """Answer strings for the bricks currently on screen, from the answer table"""
+        answer = self.engine.problems.answer
+        if self.multi_brick:
+            return [str(answer(brick.number)) for brick in self.engine.bricks.values()]
+        if self.engine.current_number is None:
+            return []
+        return [str(answer(self.engine.current_number))]
+            
+    def on_answer_changed(self, *trace_args):
+        """Instant answer mode: match the entry's text whenever it changes
+
+        The text is read back from the Entry's variable, so typing over a
+        selection, deleting, pasting and mouse edits are all seen. An answer
+        is taken the moment it matches a brick, and text no brick's answer
+        starts with turns the entry red straight away.
+        """
+        if not self.instant_answer or not self.engine.game_active or self.engine.game_paused:
+            return
+        typed = self.answer_text.get().strip()
+        targets = self.live_answer_texts()
+        if typed in targets and self.submit_typed_answer(int(typed)):
+            return
+        possible = not typed or any(t.startswith(typed) for t in targets)
+        self.answer_entry.config(bg="#FFFFFF" if possible else "#FFE0E0")
             
-            self.canvas.coords(piece, new_x - 5, new_y - 5, new_x + 5, new_y + 5)
+    @profiled
+    def explode_brick(self, brick_id=None):
+        sprite = self.brick_sprite if brick_id is None else self.lane_sprites.get(brick_id)
+        if sprite is None or not sprite.visible:
+            return
             
-        self.game_window.after(50, lambda: self.animate_explosion(pieces, frame + 1))
+        # Get brick position
+        center_x, center_y = sprite.center()
         
-    def lose_life(self):
-        self.lives -= 1
+        # Hide the brick until it is recycled
+        if brick_id is None:
+            sprite.hide()
+        else:
+            self.release_lane_brick(brick_id)
         
-        # Add failed number to the list
-        self.failed_numbers.append(self.current_number)
-        self.update_failed_numbers_display()
+        # Throw debris from the particle pool
+        self.particles.burst(center_x, center_y)
         
-        # Clear all brick elements completely
-        if hasattr(self, 'current_brick') and self.current_brick:
-            self.canvas.delete(self.current_brick)
-        if hasattr(self, 'brick_highlight'):
-            self.canvas.delete(self.brick_highlight)
-        if hasattr(self, 'brick_shadow'):
-            self.canvas.delete(self.brick_shadow)
-        if hasattr(self, 'brick_text'):
-            self.canvas.delete(self.brick_text)
-        if hasattr(self, 'brick_text_shadow'):
-            self.canvas.delete(self.brick_text_shadow)
-        self.current_brick = None
+    @profiled
+    def lose_life(self, missed_number, brick_id=None):
+        # The engine already recorded the failed number
+        self.update_failed_numbers_display()
+        self.record_performance(missed_number)
+        self.record_history(missed_number)
+        self.record_drill(missed_number)
+        if self.current_mode == RACE_MODE and self.race_client:
+            index = self.engine.level + len(self.engine.failed_numbers) - 1
+            self.race_client.send({"type": "miss", "index": index})
+        
+        # Hide the brick until it is recycled
+        if brick_id is None:
+            self.brick_sprite.hide()
+        else:
+            self.release_lane_brick(brick_id)
         
         # Show correct answer briefly
-        correct_answer = self.current_number ** 2
+        correct_answer = self.engine.problems.answer(missed_number)
         self.message_label.config(text=f"Fail! The correct answer was: {correct_answer}")
         
         # Clear the message after 2 seconds
@@ -1216,54 +4254,43 @@ class MentalMathGame:
             heart = self.heart_labels.pop()
             heart.destroy()
             
-        # Clear answer field
-        self.answer_entry.delete(0, tk.END)
-        
-        if self.lives <= 0:
-            self.game_over()
-        else:
-            # Spawn new brick and refocus entry
-            self.spawn_new_brick()
-            self.game_window.after(100, self.auto_focus_entry)
+        # Clear answer field; the engine follows up with a spawn or game over
+        self.clear_answer_entry()
     
     def update_failed_numbers_display(self):
-        # Clear existing failed numbers
-        for widget in self.failed_scrollable_frame.winfo_children():
-            widget.destroy()
-        
-        # Add all failed numbers
-        for number in self.failed_numbers:
-            label = tk.Label(self.failed_scrollable_frame, text=str(number), 
+        # Only add labels for numbers failed since the last update, so a
+        # miss costs the same however long the list is
+        for number in self.engine.failed_numbers[self.failed_numbers_shown:]:
+            label = tk.Label(self.failed_scrollable_frame, text=self.engine.problems.prompt(number), 
                            font=("Arial", 11), bg="white", fg="#C73E1D", 
                            relief="flat", pady=2)
             label.pack(fill="x", padx=5, pady=1)
+        self.failed_numbers_shown = len(self.engine.failed_numbers)
         
-        # Update scroll region
-        self.failed_scrollable_frame.update_idletasks()
-        self.failed_canvas.configure(scrollregion=self.failed_canvas.bbox("all"))
+        # The frame's <Configure> binding updates the scroll region once Tk
+        # has laid out the new label, without forcing a synchronous update
         
     def game_over(self):
-        self.game_active = False
-        self.game_paused = False
-        
-        # Clear all brick elements
-        if hasattr(self, 'current_brick') and self.current_brick:
-            self.canvas.delete(self.current_brick)
-        if hasattr(self, 'brick_highlight'):
-            self.canvas.delete(self.brick_highlight)
-        if hasattr(self, 'brick_shadow'):
-            self.canvas.delete(self.brick_shadow)
-        if hasattr(self, 'brick_text'):
-            self.canvas.delete(self.brick_text)
-        if hasattr(self, 'brick_text_shadow'):
-            self.canvas.delete(self.brick_text_shadow)
+        self.close_session_log()
+        self.dump_profile()
+        if self.snapshot_owner is self.engine:
+            self.delete_snapshot()  # Races and drills leave another game's save alone
+        self.flush_answer_history()
+        self.save_drill_schedule()
+        
+        # Hide the bricks and any debris
+        self.brick_sprite.hide()
+        for brick_id in list(self.lane_sprites):
+            self.release_lane_brick(brick_id)
+        self.particles.clear()
         
         # Show FAIL message on the game canvas with better readability
         # Create background rectangle for better contrast
         fail_bg = self.canvas.create_rectangle(50, 150, 400, 320, fill="#000000", outline="#FF0000", width=4)
         self.canvas.create_rectangle(55, 155, 395, 315, fill="#330000", outline="")  # Inner shadow
         
-        self.canvas.create_text(225, 200, text="GAME OVER", font=("Courier", 32, "bold"), fill="#FF0000", tags="gameover")
+        finished_drill = self.current_mode == DRILL_MODE and self.engine.lives > 0
+        self.canvas.create_text(225, 200, text="DRILL DONE" if finished_drill else "GAME OVER", font=("Courier", 32, "bold"), fill="#FF0000", tags="gameover")
         
         # Create readable background for instructions
         instruction_bg = self.canvas.create_rectangle(80, 250, 370, 290, fill="#FFFF00", outline="#000000", width=2)
@@ -1274,22 +4301,137 @@ class MentalMathGame:
         self.game_window.bind("<KeyPress-space>", self.show_stats)
         self.game_window.focus_set()
         
+    def score_qualifies(self):
+        """Only default, non-custom, non-training games reach the leaderboard"""
+        return (self.current_mode not in ("Custom", RACE_MODE) and self.current_hardness != "Custom" and
+                self.engine.starting_lives == 3 and self.engine.picker is None and
+                not self.multi_brick and self.engine.problems.name == "squares" and
+                self.engine.level > 0)
+        
+    def draw_latency_histogram(self, parent, times, width=420, height=130, bins=20):
+        """Bar chart of answer times on one canvas"""
+        histogram = tk.Canvas(parent, width=width, height=height, bg="white",
+                              highlightthickness=1, highlightbackground="#CCCCCC")
+        histogram.pack(pady=10)
+        
+        top = max(times)
+        bin_width = top / bins if top > 0 else 1
+        counts = [0] * bins
+        for t in times:
+            counts[min(bins - 1, int(t / bin_width))] += 1
+        
+        # Leave room for the axis labels below the bars
+        chart_height = height - 22
+        bar_width = (width - 20) / bins
+        tallest = max(counts)
+        for i, count in enumerate(counts):
+            if count:
+                x = 10 + i * bar_width
+                bar_height = count / tallest * (chart_height - 10)
+                histogram.create_rectangle(x + 1, chart_height - bar_height, x + bar_width - 1, chart_height,
+                                           fill="#4A90E2", outline="")
+        histogram.create_line(10, chart_height, width - 10, chart_height, fill="#333")
+        histogram.create_text(10, chart_height + 4, text="0s", anchor="nw", font=("Arial", 9))
+        histogram.create_text(width - 10, chart_height + 4, text=f"{top:.1f}s", anchor="ne",
+                              font=("Arial", 9))
+        histogram.create_text(width / 2, chart_height + 4, text="Answer time distribution",
+                              anchor="n", font=("Arial", 9), fill="gray")
+        
+    def draw_lifetime_heatmap(self, parent, panel_width=300, gap=20, top=18):
+        """The player's lifetime miss rate and median time for every number, as one image
+        
+        The history is aggregated on the persistence thread, after this
+        game's answers are written, and drawn when the result arrives.
+        """
+        if load_numpy() is None:
+            return
+        max_number = self.engine.max_number
+        problems = self.engine.problems.name
+        player = self.player_name()
+        block = -(-max_number // HEATMAP_CELLS)
+        cells = -(-max_number // block)
+        # Twice as wide as tall, so both panels fit the game window
+        columns = math.ceil(math.sqrt(2 * cells))
+        cell = max(1, panel_width // columns)
+        panel = columns * cell
+        height = -(-cells // columns) * cell
+        heatmap = tk.Canvas(parent, width=2 * panel + gap, height=top + height + 20,
+                            bg=parent.cget("bg"), highlightthickness=0)
+        heatmap.pack(pady=5)
+        heatmap.create_text(panel + gap / 2, top + height / 2, text="Loading lifetime stats...",
+                            font=("Arial", 10), fill="gray", tags="status")
+        
+        result = []
+        def aggregate():
+            try:
+                result.append(number_heatmap(*load_answer_history(), max_number, problems,
+                                             player, block))
+            except (OSError, ValueError, KeyError) as e:
+                result.append(e)
+        self.persistence.submit(aggregate, "the lifetime heatmap")
+        
+        def draw():
+            if not heatmap.winfo_exists():
+                return
+            if not result:
+                heatmap.after(50, draw)
+                return
+            if isinstance(result[0], Exception):
+                heatmap.itemconfig("status", text=f"Lifetime stats unavailable: {result[0]}")
+                return
+            attempts, miss_rate, median = result[0]
+            if not attempts.any():
+                heatmap.itemconfig("status", text="No lifetime history yet")
+                return
+            
+            # Slowest 5% and fastest 5% of numbers saturate the color scale
+            fast, slow = np.nanpercentile(median[1:], [5, 95]) if not np.isnan(median[1:]).all() \
+                else (0.0, 0.0)
+            background = [channel >> 8 for channel in heatmap.winfo_rgb(heatmap.cget("bg"))]
+            spacer = np.empty((height, gap, 3), dtype=np.uint8)
+            spacer[:] = background
+            pixels = np.concatenate([heatmap_pixels(miss_rate, 0.0, 0.5, columns, cell), spacer,
+                                     heatmap_pixels(median, fast, slow, columns, cell)], axis=1)
+            self.heatmap_image = tk.PhotoImage(data=ppm_data(pixels), format="PPM")
+            heatmap.delete("status")
+            heatmap.create_image(0, top, image=self.heatmap_image, anchor="nw")
+            heatmap.create_text(panel / 2, top / 2, text="Miss rate (red: 50%+)", font=("Arial", 9))
+            heatmap.create_text(panel + gap + panel / 2, top / 2,
+                                text=f"Median time ({fast:.1f}s to {slow:.1f}s)", font=("Arial", 9))
+            caption = "Lifetime, per number" if block == 1 else f"Lifetime, per {block} numbers"
+            heatmap.create_text(panel + gap / 2, top + height + 10, text=caption,
+                                font=("Arial", 9), fill="gray", tags="detail")
+            
+            def on_motion(event):
+                x = event.x if event.x < panel else event.x - panel - gap
+                index = (event.y - top) // cell * columns + x // cell + 1
+                if 0 <= x < panel and event.y >= top and 1 <= index <= cells:
+                    first = (index - 1) * block + 1
+                    last = min(index * block, max_number)
+                    numbers = str(first) if first == last else f"{first}-{last}"
+                    if attempts[index]:
+                        text = f"{numbers}: {attempts[index]} tries, {miss_rate[index]:.0%} missed"
+                        if not np.isnan(median[index]):
+                            text += f", median {median[index]:.2f}s"
+                    else:
+                        text = f"{numbers}: never played"
+                else:
+                    text = caption
+                heatmap.itemconfig("detail", text=text)
+            heatmap.bind("<Motion>", on_motion)
+        heatmap.after(50, draw)
+        
     def show_stats(self, event=None):
+        # Only once, however often space is pressed
+        self.game_window.unbind("<KeyPress-space>")
+        
         # Save to leaderboard if using default settings and not custom mode
-        if (self.current_mode != "Custom" and self.current_hardness != "Custom" and
-            self.settings["lives"] == 3 and self.level > 0):
-            
-            leaderboard = self.load_leaderboard()
+        if self.score_qualifies():
             key = f"{self.current_mode}_{self.current_hardness}"
-            
-            if key not in leaderboard:
-                leaderboard[key] = []
-            
-            leaderboard[key].append(self.level)
-            leaderboard[key].sort(reverse=True)
-            leaderboard[key] = leaderboard[key][:5]  # Keep top 5
-            
-            self.save_leaderboard(leaderboard)
+            level, player = self.engine.level, self.player_name()
+            self.leaderboard.push(key, level, player)  # Listed right away, written behind
+            self.persistence.submit(lambda: self.disk_leaderboard.add_score(key, level, player),
+                                    "your score")
         
         # Clear the game window
         for widget in self.game_window.winfo_children():
@@ -1301,20 +4443,37 @@ class MentalMathGame:
         
         tk.Label(stats_frame, text="GAME STATS", font=("Arial", 24, "bold")).pack(pady=20)
         
-        tk.Label(stats_frame, text=f"Level Reached: {self.level}", 
+        tk.Label(stats_frame, text=f"Level Reached: {self.engine.level}", 
                 font=("Arial", 18)).pack(pady=10)
         
-        if self.answer_times:
-            avg_time = sum(self.answer_times) / len(self.answer_times)
+        times = self.engine.answer_times
+        if times:
+            avg_time = sum(times) / len(times)
             tk.Label(stats_frame, text=f"Average Time per Correct Answer: {avg_time:.2f}s",
                     font=("Arial", 18)).pack(pady=10)
+            tk.Label(stats_frame, text=f"p50 {percentile(times, 50):.2f}s   "
+                                      f"p90 {percentile(times, 90):.2f}s   "
+                                      f"p99 {percentile(times, 99):.2f}s",
+                    font=("Arial", 14)).pack()
+            if self.answer_latencies:
+                first_keys = [first_key for _, first_key, _ in self.answer_latencies]
+                typing = [typed for _, _, typed in self.answer_latencies]
+                tk.Label(stats_frame, text=f"Median first keypress {percentile(first_keys, 50):.2f}s, "
+                                          f"typing {percentile(typing, 50):.2f}s",
+                        font=("Arial", 11), fg="gray").pack(pady=(2, 0))
+            self.draw_latency_histogram(stats_frame, times)
         else:
             tk.Label(stats_frame, text="Average Time per Correct Answer: N/A",
                     font=("Arial", 18)).pack(pady=10)
         
+        if self.frame_clock and self.frame_clock.dropped_frames:
+            tk.Label(stats_frame, text=f"Dropped frames: {self.frame_clock.dropped_frames}",
+                    font=("Arial", 10), fg="gray").pack()
+        
+        self.draw_lifetime_heatmap(stats_frame)
+        
         # Show leaderboard message if score was saved
-        if (self.current_mode != "Custom" and self.current_hardness != "Custom" and
-            self.settings["lives"] == 3 and self.level > 0):
+        if self.score_qualifies():
             tk.Label(stats_frame, text="Score saved to leaderboard!", 
                     font=("Arial", 14), fg="green").pack(pady=5)
             
@@ -1352,11 +4511,374 @@ class MentalMathGame:
         if self.game_window:
             self.game_window.destroy()
             self.game_window = None
-        self.game_active = False
+        if self.engine and self.engine.game_active:
+            self.save_snapshot()  # Resumable from the start screen
+            self.update_resume_button()
+            self.engine.game_active = False
+        self.close_session_log()
+        self.dump_profile()
+        self.flush_answer_history()
+        self.save_drill_schedule()
+        self.update_drill_option()
+        # Let the stats database checkpoint; the next game reopens it
+        self.persistence.submit(self.close_performance_store, "lifetime stats")
         
     def run(self):
         self.root.mainloop()
 
-if __name__ == "__main__":
+def startup_report():
+    """Time a cold start to the drawn start screen and the secondary windows
+
+    Prints how long each phase took; the manual, settings and leaderboard
+    windows are opened twice to show the cost of building them against
+    re-showing the hidden window.
+    """
+    timings = [("interpreter and imports (CPU)", time.process_time())]
+    started = time.perf_counter()
+    game = MentalMathGame()
+    timings.append(("MentalMathGame()", time.perf_counter() - started))
+    mark = time.perf_counter()
+    game.root.update()
+    timings.append(("first draw", time.perf_counter() - mark))
+    timings.append(("start screen ready", time.perf_counter() - started))
+    for name, lazy_window in (("manual", game.manual_window), ("settings", game.settings_window),
+                              ("leaderboard", game.leaderboard_window)):
+        for opening in ("first", "again"):
+            mark = time.perf_counter()
+            lazy_window.show()
+            game.root.update()
+            timings.append((f"{name} ({opening})", time.perf_counter() - mark))
+            lazy_window.hide()
+    game.root.destroy()
+    for name, seconds in timings:
+        print(f"{name:<32}{seconds * 1000:>9.1f} ms")
+    return 0
+
+
+def time_calls(func, repeat, setup=None):
+    """Wall time of each of repeat calls to func in seconds; setup() runs untimed first"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter_ns()
+        func()
+        samples.append((time.perf_counter_ns() - started) / 1e9)
+    return samples
+
+
+def benchmark_result(name, samples, **params):
+    return {"name": name, "unit": "s", "runs": len(samples), "min": min(samples),
+            "median": percentile(samples, 50), "p95": percentile(samples, 95),
+            "max": max(samples), **params}
+
+
+def benchmark_engine(frames=600, bricks=4):
+    """Per-frame GameEngine.step() cost with 1 and bricks bricks, no Tk needed"""
+    results = []
+    for count in (1, bricks):
+        if count > 1:
+            engine = MultiBrickEngine(SPEED_MODES["Newbie"], HARDNESS_LEVELS["Easy"], 3,
+                                      seed=1, max_bricks=count)
+        else:
+            engine = GameEngine(SPEED_MODES["Newbie"], HARDNESS_LEVELS["Easy"], 3, seed=1)
+        engine.spawn_brick()
+        samples = time_calls(lambda: engine.step(1 / 60), frames)
+        results.append(benchmark_result("engine_step", samples, bricks=count))
+    return results
+
+
+def benchmark_leaderboard(sizes=(10, 10_000, 1_000_000), repeat=3):
+    """Leaderboard save/load cost with count scores stored, in the working directory"""
+    results = []
+    keys = [f"{mode}_{hardness}" for mode in SPEED_MODES for hardness in HARDNESS_LEVELS]
+    for count in sizes:
+        rng = random.Random(count)
+        scores = {key: [] for key in keys}
+        for i in range(count):
+            scores[keys[i % len(keys)]].append([rng.randint(0, 500), f"player{i % 50}"])
+        path = f"leaderboard_{count}.json"
+        board = Leaderboard(path, size=count)
+        results.append(benchmark_result("save_leaderboard",
+                                        time_calls(lambda: board.save(scores), repeat),
+                                        scores=count))
+        results.append(benchmark_result("load_leaderboard_cold",
+                                        time_calls(lambda: Leaderboard(path, size=count).load(),
+                                                   repeat),
+                                        scores=count))
+        results.append(benchmark_result("load_leaderboard_cached", time_calls(board.load, repeat),
+                                        scores=count))
+    return results
+
+
+def benchmark_game(repeat=200, bricks=4, failed_sizes=(10, 100, 1000)):
+    """Time the Tk front-end's hot paths on a real (possibly virtual) display"""
     game = MentalMathGame()
-    game.run()
\ No newline at end of file
+    game.root.withdraw()
+    game.settings.update(record_sessions=False, adaptive=False, instant_answer=False, lives=3)
+    results = []
+    sim_time = [0.0]  # Frame clock that advances exactly one frame per update
+
+    def pending_idle():
+        game.root.update_idletasks()
+
+    try:
+        for count in (1, bricks):
+            game.settings["bricks"] = count
+            game.start_game(SPEED_MODES["Newbie"], "Newbie", HARDNESS_LEVELS["Easy"], "Easy")
+            game.game_window.withdraw()
+            game.frame_clock = FrameClock(game.settings["tick_rate"], clock=lambda: sim_time[0])
+            game.frame_clock.reset()
+
+            def next_frame():
+                sim_time[0] += game.frame_clock.frame_time
+                pending_idle()
+            samples = time_calls(game.update_game, repeat, setup=next_frame)
+            results.append(benchmark_result("update_game", samples, bricks=count))
+            # Drop the frames update_game queued, they would never run anyway
+            for after_id in game.root.tk.splitlist(game.root.tk.call("after", "info")):
+                game.root.after_cancel(after_id)
+
+        # Single brick game from here on
+        game.settings["bricks"] = 1
+        game.start_game(SPEED_MODES["Newbie"], "Newbie", HARDNESS_LEVELS["Easy"], "Easy")
+        game.game_window.withdraw()
+
+        def persisted():
+            # The previous draw queued its PNG on the persistence thread
+            done = threading.Event()
+            game.persistence.submit(done.set, "the benchmark")
+            done.wait()
+
+        def cold_background():
+            persisted()
+            game.canvas.delete("background")
+            game.background_images.clear()
+            game.background_png.clear()
+            if os.path.isdir(BACKGROUND_CACHE_DIR):
+                for name in os.listdir(BACKGROUND_CACHE_DIR):
+                    os.remove(os.path.join(BACKGROUND_CACHE_DIR, name))
+            pending_idle()
+
+        def disk_cached_background():
+            persisted()
+            game.canvas.delete("background")
+            game.background_images.clear()
+            game.background_png.clear()
+            game.load_background_cache()
+            pending_idle()
+
+        draw = lambda: game.draw_background(0)
+        results.append(benchmark_result("draw_background", time_calls(draw, 10, cold_background),
+                                        cache="none"))
+        results.append(benchmark_result("draw_background",
+                                        time_calls(draw, 10, disk_cached_background),
+                                        cache="disk"))
+        results.append(benchmark_result("draw_background",
+                                        time_calls(draw, repeat,
+                                                   lambda: game.canvas.delete("background")),
+                                        cache="memory"))
+
+        def new_number():
+            game.engine.spawn_brick()
+            pending_idle()
+        results.append(benchmark_result("spawn_new_brick",
+                                        time_calls(game.spawn_new_brick, repeat, new_number)))
+
+        def visible_brick():
+            game.particles.clear()
+            game.engine.spawn_brick()
+            game.spawn_new_brick()
+            pending_idle()
+        results.append(benchmark_result("explode_brick",
+                                        time_calls(game.explode_brick, repeat, visible_brick)))
+
+        rng = random.Random(0)
+
+        def one_more_miss():
+            game.engine.failed_numbers.append(rng.randint(1, game.engine.max_number))
+            pending_idle()
+        samples = time_calls(game.update_failed_numbers_display, max(failed_sizes), one_more_miss)
+        for size in failed_sizes:
+            results.append(benchmark_result("update_failed_numbers_display",
+                                            samples[max(0, size - 10):size], failed=size))
+    finally:
+        game.close_game()
+        game.shutdown()  # Before the scratch directory goes away
+        game.root.destroy()
+    return results
+
+
+def start_virtual_display():
+    """Start Xvfb when there is no display; returns the process or None"""
+    if os.environ.get("DISPLAY") or not shutil.which("Xvfb"):
+        return None
+    display = f":{100 + os.getpid() % 400}"
+    process = subprocess.Popen(["Xvfb", display, "-screen", "0", "1024x768x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = display
+    time.sleep(0.5)  # Give the server time to accept connections
+    return process
+
+
+def run_benchmarks(repeat=200, leaderboard_sizes=(10, 10_000, 1_000_000)):
+    """Run every benchmark in a scratch directory and return the results as a dict
+
+    The engine and leaderboard benchmarks are headless. The Tk ones need a
+    display: Xvfb is started when none is set, and they are reported as
+    skipped if Tk still cannot connect.
+    """
+    report = {
+        "version": 1,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "tk": tk.TkVersion,
+        "platform": sys.platform,
+        "results": [],
+        "skipped": [],
+    }
+    cwd = os.getcwd()
+    xvfb = start_virtual_display()
+    try:
+        with tempfile.TemporaryDirectory(prefix="square_the_brick_bench_") as scratch:
+            os.chdir(scratch)  # Keep settings, caches and stats out of the real ones
+            report["results"] += benchmark_engine()
+            report["results"] += benchmark_leaderboard(leaderboard_sizes)
+            try:
+                report["results"] += benchmark_game(repeat)
+            except tk.TclError as e:
+                report["skipped"].append({"name": "tk", "reason": str(e)})
+            os.chdir(cwd)  # Windows can't remove the directory we are in
+    finally:
+        os.chdir(cwd)
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Square The Brick! mental math game")
+    parser.add_argument("--replay", metavar="LOG", nargs="+",
+                        help="replay recorded session logs headlessly and check them")
+    parser.add_argument("--profile", action="store_true",
+                        help="record frame timings (F3 toggles the overlay), saved to profiles/")
+    parser.add_argument("--race", metavar="HOST[:PORT]",
+                        help="join the races run by a race server")
+    parser.add_argument("--race-server", action="store_true",
+                        help="run a race server for head-to-head games")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address the race server listens on (0.0.0.0 for the LAN)")
+    parser.add_argument("--port", type=int, default=RACE_PORT, help="race server port")
+    parser.add_argument("--race-mode", choices=list(SPEED_MODES), default="Intermediate",
+                        help="speed mode of the races")
+    parser.add_argument("--race-hardness", choices=list(HARDNESS_LEVELS), default="Medium",
+                        help="hardness level of the races")
+    parser.add_argument("--race-problems", choices=list(PROBLEM_TYPES), default="squares",
+                        help="problems asked in the races")
+    parser.add_argument("--min-players", type=int, default=2,
+                        help="players needed before a race counts down")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="time startup and the first and repeat opening of each window, then exit")
+    parser.add_argument("--benchmark", metavar="FILE", nargs="?", const="-",
+                        help="time the game's hot paths and write JSON results to FILE (default stdout)")
+    parser.add_argument("--benchmark-quick", action="store_true",
+                        help="stop the leaderboard benchmark at 10k scores; implies --benchmark")
+    parser.add_argument("--history-summary", action="store_true",
+                        help="map the answer history and print latency stats per mode and hardness")
+    parser.add_argument("--tune-difficulty", action="store_true",
+                        help="simulate every mode/hardness pair and print expected levels")
+    parser.add_argument("--games", type=int, default=100_000,
+                        help="games per pair for --tune-difficulty")
+    parser.add_argument("--speed-increase", action="store_true",
+                        help="simulate with speed increase mode enabled")
+    args = parser.parse_args()
+    if args.benchmark_quick and not args.benchmark:
+        args.benchmark = "-"
+    
+    if args.startup_report:
+        return startup_report()
+    
+    if args.race_server:
+        server = RaceServer(args.host, args.port, SPEED_MODES[args.race_mode],
+                            HARDNESS_LEVELS[args.race_hardness], min_players=args.min_players,
+                            problems=args.race_problems)
+        ready = lambda port: print(f"Race server listening on {args.host}:{port}, "
+                                   f"waiting for {args.min_players} players", flush=True)
+        try:
+            asyncio.run(server.serve(ready))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    
+    if args.benchmark:
+        sizes = (10, 10_000) if args.benchmark_quick else (10, 10_000, 1_000_000)
+        report = run_benchmarks(leaderboard_sizes=sizes)
+        if args.benchmark == "-":
+            json.dump(report, sys.stdout, indent=1)
+            print()
+        else:
+            with open(args.benchmark, "w") as f:
+                json.dump(report, f, indent=1)
+        for skipped in report["skipped"]:
+            print(f"Skipped {skipped['name']} benchmarks: {skipped['reason']}", file=sys.stderr)
+        return 0
+    
+    if args.history_summary:
+        started = time.perf_counter()
+        columns, categories = load_answer_history()
+        loaded = time.perf_counter() - started
+        print(f"{len(columns['timestamp']):,} answers mapped in {loaded * 1000:.1f}ms")
+        correct = columns["correct"].astype(bool)
+        # One code per mode and hardness pair, counted without sorting
+        width = max(len(categories["hardness"]), 1)
+        pairs = columns["mode"].astype(np.int64) * width + columns["hardness"]
+        print(f"{'Mode_Hardness':<26}{'answers':>9}{'misses':>8}{'median s':>10}{'p90 s':>8}")
+        for pair in np.flatnonzero(np.bincount(pairs)):
+            mode, hardness = divmod(int(pair), width)
+            rows = pairs == pair
+            latencies = columns["latency"][rows & correct]
+            median, p90 = np.percentile(latencies, [50, 90]) if latencies.size else (np.nan, np.nan)
+            key = f"{categories['mode'][mode]}_{categories['hardness'][hardness]}"
+            print(f"{key:<26}{latencies.size:>9,}{int((rows & ~correct).sum()):>8,}"
+                  f"{median:>10.2f}{p90:>8.2f}")
+        return 0
+    
+    if args.tune_difficulty:
+        started = time.perf_counter()
+        table = difficulty_table(games=args.games, speed_increase=args.speed_increase)
+        print(f"{'Mode_Hardness':<22}{'mean':>8}{'p10':>6}{'median':>8}{'p90':>6}"
+              f"{'reach 10':>10}{'reach 50':>10}")
+        for key, result in table.items():
+            survival = result["survival"]
+            reach = [survival[L] if L < len(survival) else 0.0 for L in (10, 50)]
+            print(f"{key:<22}{result['mean_level']:>8.1f}{result['p10_level']:>6.0f}"
+                  f"{result['median_level']:>8.0f}{result['p90_level']:>6.0f}"
+                  f"{reach[0]:>10.1%}{reach[1]:>10.1%}")
+        print(f"{len(table) * args.games:,} games in {time.perf_counter() - started:.1f}s")
+        return 0
+    
+    
+    if args.replay:
+        failures = 0
+        for path in args.replay:
+            header, records = SessionLog.read(path)
+            started = time.perf_counter()
+            engine, mismatches = replay_session(header, records)
+            elapsed = time.perf_counter() - started
+            status = "OK" if not mismatches else f"DIVERGED at event {mismatches[0]}"
+            speedup = engine.clock / elapsed if elapsed > 0 else float("inf")
+            print(f"{path}: level {engine.level}, {len(engine.failed_numbers)} misses, "
+                  f"{engine.clock:.1f}s of play in {elapsed * 1000:.1f}ms ({speedup:.0f}x) - {status}")
+            failures += bool(mismatches)
+        return 1 if failures else 0
+    
+    race = None
+    if args.race:
+        host, _, port = args.race.partition(":")
+        race = (host or "127.0.0.1", int(port or RACE_PORT))
+    game = MentalMathGame(profile=args.profile, race=race)
+    game.run()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,162 @@
+import json
+import random
+
+import pytest
+
+from square_the_brick_8 import (FenwickSampler, GameEngine, GameSnapshot, Leaderboard,
+                                MultiBrickEngine, SessionLog, atomic_write_json, replay_session,
+                                simulate_session)
+
+
+def play(engine, seconds, dt=1 / 60):
+    """Step engine for seconds, answering odd numbers once their brick has fallen a second
+
+    Returns the events step() produced, so two engines can be compared.
+    """
+    events = []
+    end = engine.clock + seconds
+    while engine.game_active and engine.clock < end:
+        events.extend(engine.step(dt))
+        if isinstance(engine, MultiBrickEngine):
+            due = [brick for brick in engine.bricks.values()
+                   if brick.number % 2 and engine.clock - brick.start >= 1]
+            for brick in due:
+                engine.submit_answer(engine.problems.answer(brick.number))
+        elif (engine.current_number is not None and engine.current_number % 2 and
+              engine.brick_elapsed >= 1):
+            engine.submit_answer(engine.problems.answer(engine.current_number))
+    return events
+
+
+def new_engine(multi_brick, **kwargs):
+    if multi_brick:
+        return MultiBrickEngine(4, 100, 20, seed=7, adaptive=True, max_bricks=3, **kwargs)
+    return GameEngine(4, 100, 20, seed=7, adaptive=True, **kwargs)
+
+
+def test_replay_reproduces_simulated_session():
+    engine = GameEngine(4, 100, 3, speed_increase=True, seed=11, adaptive=True)
+    engine.log = SessionLog(engine.describe())
+    rng = random.Random(3)
+
+    def player(number):
+        answer = engine.problems.answer(number)
+        return (answer if rng.random() > 0.1 else answer + 1), rng.uniform(0.5, 4.5)
+
+    simulate_session(engine, player, max_time=600)
+    assert engine.level > 0 and engine.failed_numbers
+
+    replayed, mismatches = replay_session(engine.log.header, engine.log.records)
+    assert mismatches == []
+    assert (replayed.level, replayed.lives) == (engine.level, engine.lives)
+
+
+def test_replay_reproduces_multi_brick_session():
+    engine = new_engine(True)
+    engine.log = SessionLog(engine.describe())
+    engine.spawn_brick()
+    play(engine, 60)
+
+    replayed, mismatches = replay_session(engine.log.header, engine.log.records)
+    assert mismatches == []
+    assert replayed.level == engine.level
+
+
+@pytest.mark.parametrize("multi_brick", [False, True])
+def test_snapshot_resumes_with_the_same_bricks(multi_brick):
+    engine = new_engine(multi_brick)
+    engine.spawn_brick()
+    play(engine, 30.5)
+    assert engine.picker.raised  # Misses have moved some weights
+
+    data = GameSnapshot.from_game(engine, "Expert", "Easy", [(1.0, 0.25, 0.75)]).to_bytes()
+    snapshot = GameSnapshot.from_bytes(data)
+    resumed = snapshot.engine()
+    assert (snapshot.mode, snapshot.hardness) == ("Expert", "Easy")
+    assert resumed.starting_lives == 20
+    assert resumed.lives == engine.lives
+
+    assert play(resumed, 60) == play(engine, 60)
+    assert (resumed.level, resumed.lives) == (engine.level, engine.lives)
+
+
+def test_snapshot_rejects_other_data():
+    with pytest.raises(ValueError):
+        GameSnapshot.from_bytes(b"not a saved game")
+    data = GameSnapshot.from_game(new_engine(False), "Expert", "Easy", []).to_bytes()
+    with pytest.raises(ValueError):
+        GameSnapshot.from_bytes(data[:-4])
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 100, 1000])
+def test_fenwick_matches_naive_sums(size):
+    rng = random.Random(size)
+    sampler = FenwickSampler(size)
+    weights = [1.0] * (size + 1)
+    for _ in range(200):
+        number = rng.randint(1, size)
+        weights[number] = rng.choice([0.5, 1.0, 2.0, 16.0])
+        sampler.set_weight(number, weights[number])
+
+    for i in range(size + 1):
+        prefix, j = 0.0, i
+        while j > 0:
+            prefix += sampler.tree[j]
+            j -= j & -j
+        assert prefix == pytest.approx(sum(weights[1:i + 1]))
+    assert sampler.total == pytest.approx(sum(weights[1:]))
+
+
+def test_fenwick_sample_follows_weights():
+    sampler = FenwickSampler(10, weight=0.0)
+    sampler.set_weight(3, 1.0)
+    sampler.set_weight(8, 3.0)
+
+    class Fixed:
+        def __init__(self, value):
+            self.value = value
+
+        def random(self):
+            return self.value
+
+    assert sampler.sample(Fixed(0.0)) == 3
+    assert sampler.sample(Fixed(0.24)) == 3
+    assert sampler.sample(Fixed(0.26)) == 8
+    assert sampler.sample(Fixed(0.999)) == 8
+
+
+def scores_on_disk(path):
+    return Leaderboard(str(path)).load()
+
+
+def test_leaderboard_compaction_keeps_every_score_once(tmp_path):
+    path = tmp_path / "leaderboard.json"
+    board = Leaderboard(str(path), size=100, compact_bytes=200)
+    for level in range(1, 41):
+        board.add_score("Expert_Easy", level, f"p{level % 3}")
+
+    assert json.loads(path.read_text())["sequence"] > 0  # Compacted at least once
+    expected = [[level, f"p{level % 3}"] for level in range(40, 0, -1)]
+    assert board.load()["Expert_Easy"] == expected
+    assert scores_on_disk(path)["Expert_Easy"] == expected
+
+
+def test_leaderboard_crash_between_snapshot_and_journal_truncate(tmp_path):
+    path = tmp_path / "leaderboard.json"
+    board = Leaderboard(str(path))
+    for level in (5, 9, 2):
+        board.add_score("Expert_Easy", level)
+
+    # The snapshot was replaced, then the game died before emptying the journal
+    board.read()
+    atomic_write_json(str(path), {"sequence": board.sequence, "scores": board.scores()})
+    assert len((tmp_path / "leaderboard.json.journal").read_text().splitlines()) == 3
+
+    board = Leaderboard(str(path))
+    board.add_score("Expert_Easy", 7)
+    expected = [[9, ""], [7, ""], [5, ""], [2, ""]]
+    assert board.load()["Expert_Easy"] == expected
+    assert scores_on_disk(path)["Expert_Easy"] == expected
+
+    board.compact()
+    assert scores_on_disk(path)["Expert_Easy"] == expected